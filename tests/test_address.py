@@ -0,0 +1,83 @@
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+
+from xibus.address import AddressError
+from xibus.address import escape
+from xibus.address import get_listen_addr
+from xibus.address import open_address
+from xibus.address import parse_address
+from xibus.connection import Connection
+from xibus.server import Server
+
+
+class TestParse(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_address('unix:path=/tmp/a%20b,guid=123;;tcp:host=localhost,port=1'),
+            [
+                ('unix', {'path': '/tmp/a b', 'guid': '123'}),
+                ('tcp', {'host': 'localhost', 'port': '1'}),
+            ],
+        )
+
+    def test_invalid(self):
+        for address in ['unix', 'unix:path', 'unix:path=a,path=b', 'unix:path=%zz']:
+            with self.subTest(address=address), self.assertRaises(AddressError):
+                parse_address(address)
+
+    def test_escape(self):
+        self.assertEqual(escape('/tmp/a b,c'), '/tmp/a%20b%2cc')
+
+    def test_listen_addr(self):
+        path, address = get_listen_addr('unix:tmpdir=/tmp')
+        self.assertTrue(path.startswith('/tmp/dbus-'))
+        self.assertEqual(address, f'unix:path={path}')
+        self.assertEqual(
+            get_listen_addr('\0foo'), ('\0foo', 'unix:abstract=foo')
+        )
+
+
+class TestOpen(unittest.IsolatedAsyncioTestCase):
+    async def test_fallback(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            async with Server(f'unix:tmpdir={tmp}') as server:
+                address = f'unix:path={tmp}/missing;{server.address}'
+                async with Connection(address, bus=False) as con:
+                    self.assertEqual(con.address, server.address)
+
+    async def test_abstract(self):
+        async with (
+            Server(f'unix:abstract=xibus-test-{os.getpid()}') as server,
+            Connection(server.address, bus=False) as con,
+        ):
+            self.assertEqual(con.address, server.address)
+
+    async def test_all_fail(self):
+        with self.assertRaises(ConnectionError):
+            await open_address('unix:path=/nonexistent;foo:bar=baz')
+
+    async def test_tcp(self):
+        listener = socket.create_server(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        try:
+            sock, process, address = await open_address(
+                f'tcp:host=127.0.0.1,port={port}'
+            )
+            self.assertIsNone(process)
+            self.assertEqual(address, f'tcp:host=127.0.0.1,port={port}')
+            sock.close()
+        finally:
+            listener.close()
+
+    async def test_unixexec(self):
+        sock, process, _ = await open_address('unixexec:path=/bin/cat')
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.sock_sendall(sock, b'foo')
+            self.assertEqual(await loop.sock_recv(sock, 3), b'foo')
+        finally:
+            sock.close()
+            await process.wait()
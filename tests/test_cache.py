@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+from xibus.cache import IntrospectCache
+from xibus.cache import get_shared_cache
+from xibus.client import Client
+
+
+class TestIntrospectCache(unittest.TestCase):
+    def test_lru(self):
+        cache = IntrospectCache(maxsize=2)
+        cache.set(('a', '/'), 1)
+        cache.set(('b', '/'), 2)
+        self.assertEqual(cache.get(('a', '/')), 1)
+        cache.set(('c', '/'), 3)
+        self.assertIsNone(cache.get(('b', '/')))
+        self.assertEqual(cache.names, {'a': {'/'}, 'c': {'/'}})
+        self.assertEqual(cache.stats, {
+            'size': 2, 'hits': 1, 'misses': 1, 'evictions': 1
+        })
+
+    def test_ttl(self):
+        cache = IntrospectCache(ttl=10)
+        with mock.patch('time.monotonic', return_value=0):
+            cache.set(('a', '/'), 1)
+        with mock.patch('time.monotonic', return_value=5):
+            self.assertEqual(cache.get(('a', '/')), 1)
+        with mock.patch('time.monotonic', return_value=11):
+            self.assertIsNone(cache.get(('a', '/')))
+
+    def test_invalidate(self):
+        cache = IntrospectCache()
+        cache.set(('a', '/'), 1)
+        cache.set(('a', '/foo'), 2)
+        cache.set(('b', '/foo'), 3)
+        cache.invalidate('a', ['/foo'])
+        self.assertEqual(len(cache), 2)
+        cache.invalidate('a')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.names, {'b': {'/foo'}})
+
+    def test_shared(self):
+        cache = get_shared_cache('unix:path=/a')
+        self.assertIs(get_shared_cache('unix:path=/a'), cache)
+        self.assertIsNot(get_shared_cache('unix:path=/b'), cache)
+        # peer-to-peer connections without address do not share
+        self.assertIsNot(get_shared_cache(None), get_shared_cache(None))
+
+    def test_client_cache(self):
+        con = mock.Mock(addr='unix:path=/a', reconnect_callbacks=[])
+        cache = IntrospectCache(maxsize=2)
+        self.assertIs(Client(con, cache).introspect_cache, cache)
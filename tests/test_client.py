@@ -1,8 +1,18 @@
+import asyncio
+import os
+import socket
+import tempfile
 import unittest
+from unittest import mock
 from unittest.mock import ANY
 
+from xibus import CallTimeoutError
 from xibus import DBusError
+from xibus import Proxy
+from xibus import client as client_module
 from xibus import get_client
+from xibus.connection import ConnectionLostError
+from xibus.schema import Schema
 
 
 class TestCall(unittest.IsolatedAsyncioTestCase):
@@ -43,6 +53,175 @@ class TestCall(unittest.IsolatedAsyncioTestCase):
             )
             self.assertIn('org.freedesktop.DBus', response)
 
+    async def test_magic_index(self):
+        async with get_client('session') as client:
+            path, iface = await client._guess_path(
+                'org.freedesktop.DBus', 'methods', 'ListNames'
+            )
+            self.assertEqual(iface, 'org.freedesktop.DBus')
+            self.assertIn('org.freedesktop.DBus', client.member_index)
+
+            with mock.patch.object(client, '_get_index') as get_index:
+                result = await client._guess_path(
+                    'org.freedesktop.DBus', 'methods', 'ListNames'
+                )
+                self.assertEqual(result, (path, iface))
+                get_index.assert_not_called()
+
+            client.invalidate('org.freedesktop.DBus')
+            self.assertNotIn('org.freedesktop.DBus', client.member_index)
+            self.assertEqual(client.resolved, {})
+
+    async def test_magic_object_manager(self):
+        root = Schema()
+        root.add_method(
+            'org.freedesktop.DBus.ObjectManager',
+            'GetManagedObjects',
+            [],
+            ['a{oa{sa{sv}}}'],
+        )
+        device = Schema()
+        device.add_method('xibus.test.Device', 'Ping', [], [])
+        objects = {
+            '/dev/a': {'xibus.test.Device': {}},
+            '/dev/b': {'xibus.test.Device': {}},
+        }
+        introspected = []
+
+        async def handler(call):
+            if call.member == 'Introspect':
+                introspected.append(call.path)
+                schema = root if call.path == '/' else device
+                return 's', (schema.to_xml(),)
+            return 'a{oa{sa{sv}}}', (objects,)
+
+        async def serve(queue):
+            async for call in queue:
+                await server.con.send_reply(call, handler)
+
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.om') as queue,
+        ):
+            task = asyncio.create_task(serve(queue))
+            try:
+                result = await client._guess_path(
+                    'xibus.test.om', 'methods', 'Ping'
+                )
+                self.assertEqual(result, ('/dev/a', 'xibus.test.Device'))
+                self.assertEqual(introspected, ['/', '/dev/a'])
+
+                await server.con.emit_signal(
+                    '/',
+                    'org.freedesktop.DBus.ObjectManager',
+                    'InterfacesRemoved',
+                    ('/dev/a', ['xibus.test.Device']),
+                    'oas',
+                )
+                await asyncio.sleep(0.1)
+                index = await client._get_index('xibus.test.om')
+                self.assertEqual(
+                    index['methods', 'Ping'], [('/dev/b', 'xibus.test.Device')]
+                )
+            finally:
+                task.cancel()
+
+    async def test_magic_index_limit(self):
+        root = Schema(nodes=[f'child{i}' for i in range(100)])
+        child = Schema()
+        child.add_method('xibus.test.Child', 'Ping', [], [])
+        active = []
+        peak = []
+
+        async def introspect(name, path):
+            active.append(path)
+            peak.append(len(active))
+            await asyncio.sleep(0.001)
+            active.remove(path)
+            return root if path == '/' else child
+
+        async with get_client('session') as client:
+            with mock.patch.object(client, 'introspect', introspect):
+                paths = await client._collect_paths('xibus.test.tree')
+            self.assertEqual(len(paths), 100)
+            self.assertEqual(paths[0][0], '/child0')
+            self.assertLessEqual(max(peak), client_module.INTROSPECT_LIMIT)
+
+    async def test_magic_index_retry(self):
+        async with get_client('session') as client:
+            collect = client._collect_paths
+            failures = [ConnectionLostError()]
+
+            async def flaky(name, path=''):
+                if failures:
+                    raise failures.pop()
+                return await collect(name, path)
+
+            with mock.patch.object(client, '_collect_paths', flaky):
+                with self.assertRaises(ConnectionLostError):
+                    await client._get_index('org.freedesktop.DBus')
+                index = await client._get_index('org.freedesktop.DBus')
+            self.assertIn(('methods', 'ListNames'), index)
+
+    async def test_call_many(self):
+        async with get_client('session') as client:
+            calls = [
+                ('GetNameOwner', ('org.freedesktop.DBus',)),
+                ('GetNameOwner', ('does.not.exist',)),
+                ('ListNames',),
+            ]
+            results = dict([
+                item async for item in client.bus.call_many(
+                    calls, limit=2, return_exceptions=True
+                )
+            ])
+            self.assertEqual(results[0], 'org.freedesktop.DBus')
+            self.assertIsInstance(results[1], DBusError)
+            self.assertIn('org.freedesktop.DBus', results[2])
+
+    async def test_magic_call_many(self):
+        async with get_client('session') as client:
+            calls = [
+                ('org.freedesktop.DBus', None, None, 'ListNames'),
+                ('org.freedesktop.DBus', None, None, 'ListNames', (), ''),
+            ]
+            results = [result async for _, result in client.call_many(calls)]
+            self.assertEqual(len(results), 2)
+            self.assertIn('org.freedesktop.DBus', results[0])
+
+    async def test_timeout(self):
+        schema = Schema()
+        schema.add_method('xibus.test.Silent', 'Ping', [], [])
+
+        async def handler(call):
+            return 's', (schema.to_xml(),)
+
+        async def serve(queue):
+            async for call in queue:
+                # never reply to Ping
+                if call.member == 'Introspect':
+                    await server.con.send_reply(call, handler)
+
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.silent') as queue,
+        ):
+            task = asyncio.create_task(serve(queue))
+            try:
+                with self.assertRaises(CallTimeoutError):
+                    await client.call(
+                        'xibus.test.silent', None, None, 'Ping', timeout=0.1
+                    )
+                proxy = Proxy(client, 'xibus.test.silent')
+                with self.assertRaises(CallTimeoutError):
+                    await proxy.call('Ping', timeout=0.05)
+                self.assertEqual(client.con.stats['timeouts'], 2)
+                self.assertEqual(client.con.replies, {})
+            finally:
+                task.cancel()
+
 
 class TestProperties(unittest.IsolatedAsyncioTestCase):
     async def test_get_property(self):
@@ -73,6 +252,54 @@ class TestProperties(unittest.IsolatedAsyncioTestCase):
             response = await client.bus.get_property('Features')
             self.assertIn('ActivatableServicesChanged', response)
 
+    async def test_property_cache(self):
+        props = {'A': ('i', 1), 'B': ('s', 'foo')}
+        calls = []
+
+        async def handler(call):
+            calls.append(call.member)
+            if call.member == 'GetAll':
+                return 'a{sv}', (props,)
+            return 'v', (props[call.body[1]],)
+
+        async def serve(queue):
+            async for call in queue:
+                await server.con.send_reply(call, handler)
+
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.props') as queue,
+        ):
+            task = asyncio.create_task(serve(queue))
+            try:
+                args = ('xibus.test.props', '/', 'xibus.test.Props')
+                a = aiter(client.watch_property(*args, 'A'))
+                b = aiter(client.watch_property(*args, 'B'))
+                self.assertEqual(await anext(a), 1)
+                self.assertEqual(await anext(b), 'foo')
+                self.assertEqual(len(client.property_caches), 1)
+                self.assertEqual(await client.get_property(*args, 'A'), 1)
+
+                props['B'] = ('s', 'bar')
+                await server.con.emit_signal(
+                    '/',
+                    'org.freedesktop.DBus.Properties',
+                    'PropertiesChanged',
+                    ('xibus.test.Props', {'A': ('i', 2)}, ['B']),
+                    'sa{sv}as',
+                )
+                self.assertEqual(await anext(a), 2)
+                self.assertEqual(await anext(b), 'bar')
+                self.assertEqual(await client.get_property(*args, 'B'), 'bar')
+                self.assertEqual(calls, ['GetAll', 'Get'])
+
+                await a.aclose()
+                await b.aclose()
+                self.assertEqual(client.property_caches, {})
+            finally:
+                task.cancel()
+
 
 class TestSignals(unittest.IsolatedAsyncioTestCase):
     async def test_subscribe_signal(self):
@@ -84,3 +311,160 @@ class TestSignals(unittest.IsolatedAsyncioTestCase):
                 i = aiter(queue)
                 self.assertEqual(await anext(i), ('xibus.test', '', ANY))
                 self.assertEqual(await anext(i), ('xibus.test', ANY, ''))
+
+    async def test_shared_match_rule(self):
+        async with get_client('session') as client:
+            await client.introspect('org.freedesktop.DBus', '/org/freedesktop/DBus')
+            # resolve the owner again below
+            client.owners.clear()
+            with mock.patch.object(client.con, 'call', wraps=client.con.call) as call:
+                async with (
+                    client.bus.subscribe_signal('NameOwnerChanged') as q1,
+                    client.bus.subscribe_signal('NameOwnerChanged') as q2,
+                ):
+                    self.assertEqual(len(client.matches), 1)
+                    async with client.acquire_name('xibus.test'):
+                        pass
+                    signal1 = await anext(aiter(q1))
+                    signal2 = await anext(aiter(q2))
+                    self.assertEqual(signal1, signal2)
+                methods = [c.args[3] for c in call.call_args_list]
+                self.assertEqual(methods.count('GetNameOwner'), 1)
+                self.assertEqual(methods.count('AddMatch'), 1)
+                self.assertEqual(methods.count('RemoveMatch'), 1)
+            self.assertEqual(client.matches, {})
+
+    async def test_reconnect(self):
+        async with (
+            get_client('session', reconnect=True) as client,
+            get_client('session') as other,
+            client.acquire_name('xibus.test.reconnect'),
+            client.bus.subscribe_signal('NameOwnerChanged') as queue,
+        ):
+            old_name = client.con.unique_name
+            await client._get_index('org.freedesktop.DBus')
+            client.con.sock.shutdown(socket.SHUT_RDWR)
+            for _ in range(50):
+                if client.con.reconnects and client.con.connected.is_set():
+                    break
+                await asyncio.sleep(0.1)
+            self.assertNotEqual(client.con.unique_name, old_name)
+            self.assertEqual(client.member_index, {})
+
+            owner = await other.bus.call('GetNameOwner', ('xibus.test.reconnect',))
+            self.assertEqual(owner, client.con.unique_name)
+
+            # the subscription still works
+            async with other.acquire_name('xibus.test.reconnect2'):
+                pass
+            async for name, _old, _new in queue:
+                if name == 'xibus.test.reconnect2':
+                    break
+
+    async def test_reconnect_lost_name(self):
+        async with (
+            get_client('session') as client,
+            get_client('session') as other,
+            other.acquire_name('xibus.test.lost'),
+        ):
+            # pretend that we owned the name before the connection was lost
+            client.names.add('xibus.test.lost')
+            handler = mock.Mock()
+            client.con.loop.set_exception_handler(handler)
+            try:
+                await client._on_reconnect()
+            finally:
+                client.con.loop.set_exception_handler(None)
+            self.assertEqual(client.names, set())
+            handler.assert_called_once()
+
+
+class TestCache(unittest.IsolatedAsyncioTestCase):
+    async def test_persistent_cache(self):
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            mock.patch.dict(os.environ, {'XDG_CACHE_HOME': tmp}),
+        ):
+            async with get_client('session', cache=True) as client:
+                await client.call('org.freedesktop.DBus', None, None, 'ListNames')
+            path = os.path.join(tmp, 'xibus', 'introspect-session.json')
+            self.assertTrue(os.path.exists(path))
+
+            async with get_client('session', cache=True) as client:
+                client.introspect_cache.data.clear()
+                con = client.con
+                with mock.patch.object(con, 'call', wraps=con.call) as call:
+                    await client.call('org.freedesktop.DBus', None, None, 'ListNames')
+                methods = [c.args[3] for c in call.call_args_list]
+                self.assertNotIn('Introspect', methods)
+
+    async def test_invalidate_on_owner_change(self):
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            mock.patch.dict(os.environ, {'XDG_CACHE_HOME': tmp}),
+        ):
+            async with get_client('session', cache=True) as client:
+                await client._watch_name('xibus.test')
+                client.disk_cache['xibus.test'] = {'owner': ':1.0', 'objects': {}}
+                client.introspect_cache.set(('xibus.test', '/'), Schema())
+                async with client.acquire_name('xibus.test'):
+                    pass
+                await asyncio.sleep(0.1)
+                self.assertNotIn('xibus.test', client.disk_cache)
+                self.assertIsNone(client.introspect_cache.get(('xibus.test', '/')))
+
+    async def test_invalidate_on_interfaces_added(self):
+        async with get_client('session') as client:
+            name = client.con.unique_name
+            await client._watch_objects(name)
+            for path in ['/', '/foo', '/foo/bar', '/other']:
+                client.introspect_cache.set((name, path), Schema())
+            await client.con.emit_signal(
+                '/foo/bar',
+                'org.freedesktop.DBus.ObjectManager',
+                'InterfacesAdded',
+                ('/foo/bar', {}),
+                'oa{sa{sv}}',
+            )
+            await asyncio.sleep(0.1)
+            self.assertIsNone(client.introspect_cache.get((name, '/foo')))
+            self.assertIsNone(client.introspect_cache.get((name, '/')))
+            self.assertIsNotNone(client.introspect_cache.get((name, '/other')))
+
+    async def test_invalid_interfaces_added(self):
+        async with get_client('session') as client:
+            name = client.con.unique_name
+            await client._watch_objects(name)
+            client.introspect_cache.set((name, '/'), Schema())
+            handler = mock.Mock()
+            client.con.loop.set_exception_handler(handler)
+            try:
+                await client.con.emit_signal(
+                    '/', 'org.freedesktop.DBus.ObjectManager', 'InterfacesAdded', (), ''
+                )
+                await client.bus.call('GetId')
+            finally:
+                client.con.loop.set_exception_handler(None)
+            handler.assert_not_called()
+            self.assertIsNotNone(client.introspect_cache.get((name, '/')))
+
+    async def test_watch_scope(self):
+        async with get_client('session') as client:
+            await client.introspect('org.freedesktop.DBus', '/org/freedesktop/DBus')
+            # no rules that match signals from every peer on the bus
+            for rule in client.handlers:
+                self.assertIsNotNone(rule.sender)
+                if rule.member == 'NameOwnerChanged':
+                    self.assertEqual(rule.args, ((0, 'org.freedesktop.DBus'),))
+            self.assertEqual(len(client.handlers), 3)
+
+    async def test_unwatch(self):
+        async with get_client('session') as client:
+            async with get_client('session') as other:
+                await client._watch_objects(other.con.unique_name)
+                self.assertEqual(len(client.handlers), 3)
+            for _ in range(50):
+                if not client.handlers:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(list(client.handlers), [])
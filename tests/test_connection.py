@@ -0,0 +1,327 @@
+import asyncio
+import os
+import socket
+import unittest
+from unittest import mock
+
+from xibus.client import merge_properties
+from xibus.client import properties_key
+from xibus.connection import CallTimeoutError
+from xibus.connection import Connection
+from xibus.connection import ConnectionLostError
+from xibus.connection import MsgQueue
+from xibus.connection import Overflow
+from xibus.connection import deadline
+from xibus.match import MatchRule
+from xibus.message import Msg
+from xibus.message import MsgType
+
+
+def reply(serial, sig, body):
+    return Msg(
+        MsgType.METHOD_RETURN,
+        serial + 100,
+        reply_serial=serial,
+        sig=sig,
+        body=body,
+    )
+
+
+class TestRead(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.con = Connection(None)
+        self.con.sock, self.peer = socket.socketpair()
+        self.con.sock.setblocking(False)
+        self.con.loop.add_reader(self.con.sock.fileno(), self.con.on_read)
+
+    async def asyncTearDown(self):
+        self.con.loop.remove_reader(self.con.sock.fileno())
+        self.con.sock.close()
+        self.peer.close()
+
+    def expect(self, *serials):
+        futures = []
+        for serial in serials:
+            future = self.con.loop.create_future()
+            self.con.replies[serial] = future
+            futures.append(future)
+        return futures
+
+    async def test_partial(self):
+        (future,) = self.expect(1)
+        buf, _ = reply(1, 's', ('x' * 200000,)).marshal()
+        for i in range(0, len(buf), 1000):
+            self.peer.sendall(buf[i:i + 1000])
+            await asyncio.sleep(0)
+        msg = await future
+        self.assertEqual(msg.body, ('x' * 200000,))
+
+    async def test_partial_after_complete(self):
+        # the buffer needs to grow while a message has been processed
+        futures = self.expect(1, 2)
+        buf1, _ = reply(1, 's', ('foo',)).marshal()
+        buf2, _ = reply(2, 's', ('x' * 200000,)).marshal()
+        self.peer.sendall(bytes(buf1) + bytes(buf2[:1000]))
+        msg1 = await futures[0]
+        self.assertEqual(msg1.body, ('foo',))
+        self.peer.sendall(buf2[1000:])
+        msg2 = await futures[1]
+        self.assertEqual(msg2.body, ('x' * 200000,))
+
+    async def test_handler_error(self):
+        (future,) = self.expect(1)
+        handler = mock.Mock()
+        self.con.loop.set_exception_handler(handler)
+        rule = MatchRule(MsgType.SIGNAL)
+        self.con.add_signal_handler(rule, mock.Mock(side_effect=ValueError))
+        data = bytes(properties_changed({}).marshal()[0]) + bytes(
+            reply(1, 's', ('foo',)).marshal()[0]
+        )
+        self.peer.sendall(data)
+        msg = await future
+        self.assertEqual(msg.body, ('foo',))
+        self.assertEqual(self.con.recv_len, 0)
+        handler.assert_called_once()
+
+    async def test_coalesced(self):
+        futures = self.expect(1, 2, 3)
+        data = b''.join(bytes(reply(i, 'u', (i,)).marshal()[0]) for i in [1, 2, 3])
+        self.peer.sendall(data[:-3])
+        await asyncio.sleep(0.01)
+        self.assertTrue(futures[1].done())
+        self.assertFalse(futures[2].done())
+        self.peer.sendall(data[-3:])
+        msgs = await asyncio.gather(*futures)
+        self.assertEqual([msg.body for msg in msgs], [(1,), (2,), (3,)])
+
+    async def test_replies_while_paused(self):
+        (future,) = self.expect(1)
+        calls = b''.join(
+            bytes(Msg(MsgType.METHOD_CALL, i, path='/', member='Ping').marshal()[0])
+            for i in range(10, 14)
+        )
+        self.peer.sendall(calls + bytes(reply(1, 's', ('foo',)).marshal()[0]))
+        with self.con.call_queue(None, maxsize=2) as queue:
+            msg = await asyncio.wait_for(future, 1)
+            self.assertEqual(msg.body, ('foo',))
+            self.assertTrue(queue.paused)
+            self.assertEqual(len(self.con.held), 2)
+
+            serials = [(await queue.get()).serial for _ in range(4)]
+            self.assertEqual(serials, [10, 11, 12, 13])
+            self.assertEqual(len(self.con.held), 0)
+
+    async def test_fds(self):
+        futures = self.expect(1, 2)
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        buf1, fds1 = reply(1, 'hh', (r1, w1)).marshal()
+        buf2, fds2 = reply(2, 'h', (r2,)).marshal()
+        socket.send_fds(self.peer, [buf1[:10]], fds1)
+        socket.send_fds(self.peer, [buf1[10:], buf2], fds2)
+        msg1, msg2 = await asyncio.gather(*futures)
+        self.assertEqual(len(msg1.body), 2)
+        self.assertEqual(len(msg2.body), 1)
+        os.write(msg1.body[1], b'a')
+        self.assertEqual(os.read(r1, 1), b'a')
+        os.write(w2, b'b')
+        self.assertEqual(os.read(msg2.body[0], 1), b'b')
+        for fd in [r1, w1, r2, w2, *msg1.body, *msg2.body]:
+            os.close(fd)
+
+
+class TestWrite(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.con = Connection(None)
+        self.con.sock, self.peer = socket.socketpair()
+        self.con.sock.setblocking(False)
+
+    async def asyncTearDown(self):
+        if self.con.sock:
+            self.con.sock.close()
+        self.peer.close()
+
+    async def test_batch(self):
+        msgs = [bytes([i]) * (i + 1) for i in range(10)]
+        await asyncio.gather(*[self.con.send(msg) for msg in msgs])
+        self.assertEqual(self.peer.recv(1000), b''.join(msgs))
+
+    async def test_partial(self):
+        self.peer.setblocking(True)
+        data = os.urandom(10_000_000)
+        task = asyncio.create_task(self.con.send(data))
+        received = b''
+        while len(received) < len(data):
+            received += await self.con.loop.run_in_executor(
+                None, self.peer.recv, 1_000_000
+            )
+        await task
+        self.assertEqual(received, data)
+
+    async def test_close(self):
+        # pending sends fail instead of waiting forever
+        drained = self.con.send_nowait(b'foo')
+        await self.con.__aexit__(None, None, None)
+        with self.assertRaises(ConnectionLostError):
+            await drained
+
+    async def test_eager(self):
+        self.con.eager_send = True
+        r, w = os.pipe()
+        await self.con.send(b'foo', [r])
+        self.assertEqual(len(self.con.send_queue), 0)
+        data, fds, _, _ = socket.recv_fds(self.peer, 1000, 10)
+        self.assertEqual(data, b'foo')
+        self.assertEqual(len(fds), 1)
+        for fd in [r, w, *fds]:
+            os.close(fd)
+
+
+class TestTimeout(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.con = Connection(None, call_timeout=0.05)
+        self.con.sock, self.peer = socket.socketpair()
+        self.con.sock.setblocking(False)
+        self.con.loop.add_reader(self.con.sock.fileno(), self.con.on_read)
+
+    async def asyncTearDown(self):
+        self.con.loop.remove_reader(self.con.sock.fileno())
+        self.con.sock.close()
+        self.peer.close()
+
+    def call(self, **kwargs):
+        return self.con.call(None, '/', None, 'Ping', (), '', **kwargs)
+
+    async def test_default(self):
+        with self.assertRaises(CallTimeoutError):
+            await self.call()
+        self.assertEqual(self.con.replies, {})
+        self.assertEqual(self.con.stats['timeouts'], 1)
+
+        # late replies are ignored
+        self.peer.sendall(reply(self.con.serial, '', ()).marshal()[0])
+        await asyncio.sleep(0.01)
+
+    async def test_per_call(self):
+        slow = asyncio.create_task(self.call(timeout=0.2))
+        results = await asyncio.gather(
+            self.call(timeout=0.01), self.call(), return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(r, CallTimeoutError) for r in results))
+        self.assertEqual(self.con.timeouts, 2)
+
+        # a longer timeout is not cut short by an earlier timer
+        self.assertFalse(slow.done())
+        with self.assertRaises(CallTimeoutError):
+            await slow
+
+    async def test_deadline(self):
+        start = self.con.loop.time()
+        with deadline(0.01), self.assertRaises(CallTimeoutError):
+            await self.call(timeout=10)
+        self.assertLess(self.con.loop.time() - start, 0.04)
+
+    async def test_call_many(self):
+        results = [
+            result async for _, result in self.con.call_many(
+                [(None, '/', None, 'Ping', (), '')] * 3,
+                return_exceptions=True,
+                timeout=0.01,
+            )
+        ]
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(isinstance(r, CallTimeoutError) for r in results))
+
+    async def test_cancel(self):
+        # entries of cancelled calls do not pile up
+        for _ in range(200):
+            task = asyncio.create_task(self.call(timeout=10))
+            await asyncio.sleep(0)
+            task.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(self.con.replies, {})
+        self.assertLess(len(self.con.deadlines), 100)
+
+    async def test_too_many_fds(self):
+        r, w = os.pipe()
+        try:
+            with self.assertRaises(ValueError):
+                self.con.send_nowait(b'x', [r] * 254)
+            self.assertEqual(len(self.con.send_queue), 0)
+        finally:
+            os.close(r)
+            os.close(w)
+
+    async def test_max_fds(self):
+        # messages with many fds are sent in separate batches
+        r, w = os.pipe()
+        await asyncio.gather(
+            self.con.send(b'a', [r] * 200), self.con.send(b'b', [r] * 200)
+        )
+        fds = []
+        data = b''
+        while len(data) < 2:
+            msg, received, _, _ = socket.recv_fds(self.peer, 10, 255)
+            data += msg
+            fds += received
+        self.assertEqual(data, b'ab')
+        self.assertEqual(len(fds), 400)
+        for fd in [r, w, *fds]:
+            os.close(fd)
+
+
+def properties_changed(changed, invalidated=()):
+    return Msg(
+        MsgType.SIGNAL,
+        1,
+        sender=':1.1',
+        path='/foo',
+        iface='org.freedesktop.DBus.Properties',
+        member='PropertiesChanged',
+        sig='sa{sv}as',
+        body=('org.example', changed, list(invalidated)),
+    )
+
+
+class TestMsgQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_drop_oldest(self):
+        queue = MsgQueue(2)
+        for i in range(5):
+            queue.put_nowait(i)
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual([await queue.get(), await queue.get()], [3, 4])
+
+    async def test_drop_newest(self):
+        queue = MsgQueue(2, Overflow.DROP_NEWEST)
+        for i in range(5):
+            queue.put_nowait(i)
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual([await queue.get(), await queue.get()], [0, 1])
+
+    async def test_coalesce(self):
+        queue = MsgQueue(
+            4, Overflow.COALESCE, key=properties_key, merge=merge_properties
+        )
+        queue.put_nowait(properties_changed({'a': ('u', 1), 'b': ('u', 1)}))
+        queue.put_nowait(properties_changed({'a': ('u', 2)}, ['b']))
+        queue.put_nowait(properties_changed({'c': ('u', 3)}))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.coalesced, 2)
+        msg = await queue.get()
+        self.assertEqual(msg.body, (
+            'org.example', {'a': ('u', 2), 'c': ('u', 3)}, ['b']
+        ))
+
+    async def test_pause(self):
+        events = []
+        queue = MsgQueue(2, Overflow.PAUSE)
+        queue.on_pause = lambda q: events.append('pause')
+        queue.on_resume = lambda q: events.append('resume')
+        for i in range(3):
+            queue.put_nowait(i)
+        self.assertEqual(events, ['pause'])
+        self.assertEqual(len(queue), 3)
+        await queue.get()
+        await queue.get()
+        self.assertEqual(events, ['pause', 'resume'])
+        self.assertEqual(queue.dropped, 0)
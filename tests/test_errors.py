@@ -0,0 +1,57 @@
+import unittest
+
+from xibus import errors
+from xibus.errors import DBusError
+
+
+class TestErrors(unittest.TestCase):
+    def test_from_reply(self):
+        e = errors.from_reply('org.freedesktop.DBus.Error.UnknownMethod', ('foo',))
+        self.assertIsInstance(e, errors.UnknownMethodError)
+        self.assertEqual(str(e), 'org.freedesktop.DBus.Error.UnknownMethod')
+        self.assertEqual(e.__notes__, ['foo'])
+
+        e = errors.from_reply('org.freedesktop.DBus.Error.TimedOut', ())
+        self.assertIsInstance(e, TimeoutError)
+        self.assertEqual(e.name, 'org.freedesktop.DBus.Error.TimedOut')
+
+        e = errors.from_reply('com.example.Error', ())
+        self.assertIs(type(e), DBusError)
+        self.assertEqual(errors.get_error_name(e), 'com.example.Error')
+
+    def test_get_error_name(self):
+        for exc, name in [
+            (DBusError('foo'), 'org.freedesktop.DBus.Error.Failed'),
+            (errors.UnknownObjectError(), 'org.freedesktop.DBus.Error.UnknownObject'),
+            (TypeError(), 'org.freedesktop.DBus.Error.InvalidArgs'),
+            (KeyError(), 'org.freedesktop.DBus.Error.Failed'),
+            (UnicodeError(), 'org.freedesktop.DBus.Error.InvalidArgs'),
+            (PermissionError(), 'org.freedesktop.DBus.Error.AccessDenied'),
+        ]:
+            with self.subTest(exc=exc):
+                self.assertEqual(errors.get_error_name(exc), name)
+
+    def test_subclass(self):
+        class CustomError(DBusError):
+            name = 'com.example.Error.Custom'
+
+        class LocalError(CustomError):
+            pass
+
+        try:
+            e = errors.from_reply('com.example.Error.Custom', ())
+            self.assertIsInstance(e, CustomError)
+            self.assertEqual(
+                errors.get_error_name(LocalError()), 'com.example.Error.Custom'
+            )
+        finally:
+            del errors.ERRORS['com.example.Error.Custom']
+
+    def test_transient(self):
+        self.assertTrue(errors.is_transient(errors.CallTimeoutError()))
+        self.assertTrue(errors.is_transient(errors.LimitsExceededError()))
+        self.assertTrue(errors.is_transient(ConnectionResetError()))
+        self.assertFalse(errors.is_transient(errors.UnknownMethodError()))
+        self.assertFalse(errors.is_transient(errors.AccessDeniedError()))
+        self.assertFalse(errors.is_transient(DBusError()))
+        self.assertFalse(errors.is_transient(ValueError()))
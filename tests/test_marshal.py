@@ -1,5 +1,10 @@
+import array
 import unittest
 
+from xibus.marshal import Reader
+from xibus.marshal import Writer
+from xibus.marshal import compile_sig
+from xibus.marshal import split_sig
 from xibus.message import Msg
 from xibus.message import MsgFlag
 from xibus.message import MsgType
@@ -363,7 +368,7 @@ MESSAGES = [
                         {
                             117: (
                                 'ay',
-                                list(b'B\x04\x01\x01p\xd0\xc2N\x08\xabW\xd2\xc2N\x08\xabV\x01\x00\x00\x00\x00\x00\x00'),
+                                b'B\x04\x01\x01p\xd0\xc2N\x08\xabW\xd2\xc2N\x08\xabV\x01\x00\x00\x00\x00\x00\x00',
                             )
                         },
                     ),
@@ -429,8 +434,61 @@ class TestMarshal(unittest.TestCase):
         with self.assertRaises(ValueError):
             Msg.unmarshal(data, [])
 
+    def test_lazy(self):
+        for i, item in enumerate(MESSAGES):
+            with self.subTest(i=i):
+                msg, _, _ = Msg.unmarshal(item['data'], [], lazy=True)
+                self.assertEqual(msg.get_body(1), item['message'].body[:1])
+                self.assertEqual(msg, item['message'])
+
     def test_remaining_data(self):
         data = MESSAGES[0]['data'] + b'\x00'
         _, tail, tail_fds = Msg.unmarshal(data, [1])
         self.assertEqual(tail, b'\x00')
         self.assertEqual(tail_fds, [1])
+
+
+class TestCodec(unittest.TestCase):
+    def test_split_sig(self):
+        self.assertEqual(
+            split_sig('a{sv}(ia(sy))asg'), ['a{sv}', '(ia(sy))', 'as', 'g']
+        )
+
+    def test_offset(self):
+        sig = 'y(yt)qa{sv}d'
+        data = (1, (2, 3), 4, {'foo': ('u', 5)}, 6.5)
+        for offset in range(8):
+            with self.subTest(offset=offset):
+                w = Writer('<')
+                w.buf = bytearray(offset)
+                w.marshal(sig, data)
+                r = Reader(w.buf, [], '<')
+                r.offset = offset
+                self.assertEqual(r.unmarshal(sig), data)
+                self.assertEqual(r.offset, len(w.buf))
+
+    def test_nested_array_alignment(self):
+        w = Writer('<')
+        w.marshal('yaat', (1, [[2], [3, 4]]))
+        self.assertEqual(len(w.buf), 48)
+        r = Reader(w.buf, [], '<')
+        self.assertEqual(r.unmarshal('yaat'), (1, [[2], [3, 4]]))
+
+    def test_fixed_arrays(self):
+        for endian in ['<', '>']:
+            w = Writer(endian)
+            w.marshal('ayayaiata(uu)', (
+                b'foo',
+                array.array('B', [1, 2]),
+                [-1, 2],
+                array.array('Q', [3]),
+                [(4, 5)],
+            ))
+            r = Reader(w.buf, [], endian)
+            with self.subTest(endian=endian):
+                self.assertEqual(r.unmarshal('ayayaiata(uu)'), (
+                    b'foo', b'\x01\x02', [-1, 2], [3], [(4, 5)]
+                ))
+
+    def test_compile_cached(self):
+        self.assertIs(compile_sig('a{sv}', '<'), compile_sig('a{sv}', '<'))
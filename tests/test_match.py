@@ -0,0 +1,71 @@
+import unittest
+
+from xibus.match import MatchRule
+from xibus.match import MatchTable
+from xibus.message import Msg
+from xibus.message import MsgType
+
+
+def signal(path='/foo', member='Changed', body=()):
+    return Msg(
+        MsgType.SIGNAL,
+        1,
+        sender=':1.1',
+        path=path,
+        iface='org.example',
+        member=member,
+        sig='s' * len(body),
+        body=body,
+    )
+
+
+class TestMatchRule(unittest.TestCase):
+    def test_str(self):
+        rule = MatchRule(
+            MsgType.SIGNAL, sender=':1.1', member='Changed', args=((1, "it's"),)
+        )
+        self.assertEqual(
+            str(rule),
+            "type='signal',sender=':1.1',member='Changed',arg1='it'\\''s'",
+        )
+
+    def test_path_namespace(self):
+        rule = MatchRule(path_namespace='/foo')
+        self.assertTrue(rule.matches(signal('/foo')))
+        self.assertTrue(rule.matches(signal('/foo/bar')))
+        self.assertFalse(rule.matches(signal('/foobar')))
+        self.assertTrue(MatchRule(path_namespace='/').matches(signal('/foo')))
+
+    def test_args(self):
+        rule = MatchRule(args=((0, 'a'),))
+        self.assertTrue(rule.matches(signal(body=('a', 'b'))))
+        self.assertFalse(rule.matches(signal(body=('b', 'a'))))
+        self.assertFalse(rule.matches(signal(body=())))
+
+    def test_arg_path(self):
+        rule = MatchRule(arg_paths=((0, '/aa/'),))
+        self.assertTrue(rule.matches(signal(body=('/aa/bb',))))
+        self.assertTrue(rule.matches(signal(body=('/',))))
+        self.assertFalse(rule.matches(signal(body=('/aa',))))
+
+    def test_arg0namespace(self):
+        rule = MatchRule(arg0namespace='org.example')
+        self.assertTrue(rule.matches(signal(body=('org.example.Foo',))))
+        self.assertFalse(rule.matches(signal(body=('org.examples',))))
+
+
+class TestMatchTable(unittest.TestCase):
+    def test_lookup(self):
+        table = MatchTable()
+        table.add(MatchRule(member='Changed'), 'a')
+        table.add(MatchRule(path='/foo', member='Changed'), 'b')
+        table.add(MatchRule(path='/bar'), 'c')
+        table.add(MatchRule(), 'd')
+
+        self.assertEqual(set(table.lookup(signal('/foo'))), {'a', 'b', 'd'})
+        self.assertEqual(set(table.lookup(signal('/bar'))), {'a', 'c', 'd'})
+        self.assertEqual(set(table.lookup(signal('/bar', 'X'))), {'c', 'd'})
+
+        table.remove(MatchRule(), 'd')
+        self.assertEqual(set(table.lookup(signal('/baz', 'X'))), set())
+        self.assertEqual(table.masks[(False, False, False, False)], 0)
@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from xibus import ConnectionPool
+from xibus import Service
+from xibus import get_client
+from xibus.connection import get_address
+from xibus.pool import pinned
+
+
+class TestPool(unittest.IsolatedAsyncioTestCase):
+    async def test_reuse(self):
+        async with ConnectionPool() as pool:
+            async with get_client('session', pool=pool) as client1:
+                await client1.introspect('org.freedesktop.DBus', '/')
+                con = client1.con
+                self.assertTrue(client1.handlers)
+            self.assertIsNotNone(con.sock)
+            self.assertEqual(con.match_table.index, {})
+
+            async with get_client('session', pool=pool) as client2:
+                self.assertIs(client2.con, con)
+                names = await client2.call(
+                    'org.freedesktop.DBus', None, None, 'ListNames'
+                )
+                self.assertIn(con.unique_name, names)
+        self.assertIsNone(con.sock)
+
+    async def test_wait_for_reconnect(self):
+        async with ConnectionPool() as pool:
+            addr = get_address('session')
+            async with pool.connection(addr) as group:
+                group.cons[0].connected.clear()
+
+            async def enter():
+                async with pool.connection(addr) as group:
+                    return group
+
+            task = asyncio.create_task(enter())
+            await asyncio.sleep(0.01)
+            self.assertFalse(task.done())
+            group.cons[0].connected.set()
+            self.assertIs(await asyncio.wait_for(task, 1), group)
+
+    async def test_spread(self):
+        async with (
+            get_client('session') as server,
+            server.acquire_name('xibus.test.pool') as queue,
+            ConnectionPool(size=2) as pool,
+            pool.connection(get_address('session')) as group,
+        ):
+            service = Service(server.con)
+            service.add_method('xibus.test.Pool', 'Ping', lambda: None)
+            task = asyncio.create_task(service.serve(queue))
+            try:
+                self.assertEqual(len(group.cons), 2)
+                self.assertNotEqual(
+                    group.cons[0].unique_name, group.cons[1].unique_name
+                )
+                self.assertEqual(group.unique_name, group.cons[0].unique_name)
+
+                calls = []
+                for con in group.cons:
+                    calls.append(mock.patch.object(con, 'call', wraps=con.call))
+                with calls[0] as call0, calls[1] as call1:
+                    await asyncio.gather(*[
+                        group.call(
+                            'xibus.test.pool', '/', 'xibus.test.Pool', 'Ping', [], ''
+                        )
+                        for _ in range(4)
+                    ])
+                    self.assertEqual(call0.call_count, 2)
+                    self.assertEqual(call1.call_count, 2)
+
+                    # calls to the bus always use the first connection
+                    await group.call(
+                        'org.freedesktop.DBus',
+                        '/org/freedesktop/DBus',
+                        'org.freedesktop.DBus.Peer',
+                        'Ping',
+                        [],
+                        '',
+                    )
+                    self.assertEqual(call0.call_count, 3)
+
+                    # calls that depend on the caller can be pinned
+                    args = ('xibus.test.pool', '/', 'xibus.test.Pool', 'Ping', [], '')
+                    with pinned():
+                        await asyncio.gather(*[group.call(*args) for _ in range(4)])
+                    self.assertEqual(call0.call_count, 7)
+                    self.assertEqual(call1.call_count, 2)
+            finally:
+                task.cancel()
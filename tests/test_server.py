@@ -0,0 +1,131 @@
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+
+from xibus.connection import Connection
+from xibus.connection import ConnectionLostError
+from xibus.errors import UnknownObjectError
+from xibus.message import Msg
+from xibus.message import MsgType
+from xibus.server import Server
+
+
+async def echo(call):
+    return call.sig, call.body
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addr = os.path.join(self.tmp.name, 'socket')
+
+    async def asyncTearDown(self):
+        self.tmp.cleanup()
+
+    async def serve(self, server):
+        async with await server.accept() as con:
+            with con.call_queue(None) as queue:
+                async for call in queue:
+                    await con.send_reply(call, echo)
+                    await con.emit_signal('/', 'org.example', 'Called', (), '')
+
+    async def test_peer(self):
+        async with Server(self.addr) as server:
+            task = asyncio.create_task(self.serve(server))
+            try:
+                async with Connection(self.addr, bus=False) as con:
+                    self.assertIsNone(con.unique_name)
+                    with con.signal_queue() as signals:
+                        result = await con.call(
+                            None, '/', 'org.example', 'Echo', ('foo', 1), 'si'
+                        )
+                        self.assertEqual(result, ('foo', 1))
+                        signal = await signals.get()
+                        self.assertEqual(signal.member, 'Called')
+            finally:
+                task.cancel()
+        self.assertFalse(os.path.exists(self.addr))
+
+    async def test_no_handler(self):
+        # calls without a call_queue() are rejected right away
+        async with (
+            Server(self.addr) as server,
+            Connection(self.addr, bus=False) as con,
+            await server.accept(),
+        ):
+            with self.assertRaises(UnknownObjectError):
+                await asyncio.wait_for(
+                    con.call(None, '/foo', None, 'Echo', ('foo',), 's'), 1
+                )
+
+    async def test_abstract(self):
+        addr = f'\0xibus-test-{os.getpid()}'
+        async with Server(addr) as server:
+            task = asyncio.create_task(self.serve(server))
+            try:
+                async with Connection(addr, bus=False) as con:
+                    result = await con.call(None, '/', None, 'Echo', ('foo',), 's')
+                    self.assertEqual(result, ('foo',))
+            finally:
+                task.cancel()
+
+    async def test_pipelined_auth(self):
+        # the first message may be sent together with the auth handshake
+        uid = str(os.getuid()).encode('ascii').hex()
+        msg = Msg(MsgType.METHOD_CALL, 1, path='/', member='Ping')
+        buf, _ = msg.marshal()
+
+        async with Server(self.addr) as server:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.addr)
+            sock.sendall(
+                f'\0AUTH EXTERNAL {uid}\r\nBEGIN\r\n'.encode('ascii') + bytes(buf)
+            )
+            async with await server.accept() as con:
+                with con.call_queue(None) as queue:
+                    call = await asyncio.wait_for(queue.get(), 1)
+                    self.assertEqual(call.member, 'Ping')
+            sock.close()
+
+    async def test_reject(self):
+        async with Server(self.addr, uids={os.getuid() + 1}) as server:
+            con = Connection(self.addr, bus=False)
+            with self.assertRaises(AssertionError):
+                async with con:
+                    pass
+            self.assertTrue(server.queue.empty())
+            # the socket is closed even though __aexit__() was not called
+            self.assertIsNone(con.sock)
+
+    async def test_reconnect(self):
+        async with (
+            Server(self.addr) as server,
+            Connection(self.addr, bus=False, reconnect=True) as con,
+        ):
+            async with await server.accept() as peer:
+                with peer.call_queue(None) as queue:
+                    task = asyncio.create_task(
+                        con.call(None, '/', None, 'Echo', ('foo',), 's')
+                    )
+                    await queue.get()
+
+            # pending calls fail when the connection is lost
+            with self.assertRaises(ConnectionLostError):
+                await asyncio.wait_for(task, 1)
+            self.assertFalse(con.connected.is_set())
+            with self.assertRaises(ConnectionLostError):
+                await con.call(None, '/', None, 'Echo', ('foo',), 's')
+
+            async with await asyncio.wait_for(server.accept(), 5) as peer:
+                with peer.call_queue(None) as queue:
+                    await asyncio.wait_for(con.connected.wait(), 1)
+                    task = asyncio.create_task(
+                        con.call(None, '/', None, 'Echo', ('foo',), 's')
+                    )
+                    await peer.send_reply(await queue.get(), echo)
+                    self.assertEqual(await task, ('foo',))
+
+            self.assertEqual(con.stats['disconnects'], 1)
+            self.assertEqual(con.stats['reconnects'], 1)
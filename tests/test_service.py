@@ -0,0 +1,326 @@
+import asyncio
+import socket
+import threading
+import unittest
+from unittest import mock
+
+from xibus import DBusError
+from xibus import get_client
+from xibus.connection import CallTimeoutError
+from xibus.connection import Connection
+from xibus.connection import ConnectionLostError
+from xibus.errors import InvalidArgsError
+from xibus.errors import PropertyReadOnlyError
+from xibus.errors import UnknownMethodError
+from xibus.message import Msg
+from xibus.message import MsgType
+from xibus.service import FairQueue
+from xibus.service import PropertiesEmitter
+from xibus.service import Service
+from xibus.service import method
+from xibus.service import prop
+from xibus.service import signal
+
+
+def call(serial, sender):
+    return Msg(MsgType.METHOD_CALL, serial, sender=sender)
+
+
+class TestFairQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_round_robin(self):
+        queue = FairQueue()
+        for serial, sender in enumerate([':1.1', ':1.1', ':1.1', ':1.2', ':1.3']):
+            await queue.put(call(serial + 1, sender))
+        self.assertEqual(len(queue), 5)
+        serials = [(await queue.get()).serial for _ in range(5)]
+        self.assertEqual(serials, [1, 4, 5, 2, 3])
+
+
+class TestService(unittest.IsolatedAsyncioTestCase):
+    async def test_serve(self):
+        event = asyncio.Event()
+
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.service') as queue,
+        ):
+            service = Service(server.con, limit=4)
+
+            @service.method('xibus.test.Service', sig='s')
+            async def Wait():
+                await event.wait()
+                return 'done'
+
+            @service.method('xibus.test.Service', sig='s')
+            def Release():
+                event.set()
+                return 'released'
+
+            @service.method('xibus.test.Service')
+            def Fail():
+                raise ValueError('invalid')
+
+            @service.method('xibus.test.Service', sig='i')
+            def Bad():
+                return 'not an int'
+
+            @service.method('xibus.test.Service', sig='bs', offload=True)
+            def Thread(s):
+                return threading.current_thread() is threading.main_thread(), s
+
+            task = asyncio.create_task(service.serve(queue))
+            try:
+                args = ('xibus.test.service', '/', 'xibus.test.Service')
+                results = await asyncio.wait_for(asyncio.gather(
+                    client.con.call(*args, 'Wait', (), ''),
+                    client.con.call(*args, 'Release', (), ''),
+                ), 5)
+                self.assertEqual(results, [('done',), ('released',)])
+
+                result = await client.con.call(*args, 'Thread', ('foo',), 's')
+                self.assertEqual(result, (False, 'foo'))
+
+                # the interface is optional
+                result = await client.con.call(
+                    'xibus.test.service', '/', None, 'Release', (), ''
+                )
+                self.assertEqual(result, ('released',))
+
+                with self.assertRaises(UnknownMethodError) as ctx:
+                    await client.con.call(*args, 'Unknown', (), '')
+                self.assertEqual(
+                    ctx.exception.__notes__,
+                    ['Unknown method xibus.test.Service.Unknown on /'],
+                )
+                with self.assertRaises(InvalidArgsError) as ctx:
+                    await client.con.call(*args, 'Fail', (), '')
+                self.assertEqual(ctx.exception.__notes__, ['invalid'])
+                # the caller also gets an error if the reply cannot be encoded
+                with self.assertRaises(DBusError):
+                    await asyncio.wait_for(client.con.call(*args, 'Bad', (), ''), 1)
+                with self.assertRaises(InvalidArgsError):
+                    await client.con.call(*args, 'Release', ('foo',), 's')
+            finally:
+                task.cancel()
+
+    async def test_fair(self):
+        # a busy caller does not delay the calls of others
+        async with (
+            get_client('session') as server,
+            get_client('session') as busy,
+            get_client('session') as other,
+            server.acquire_name('xibus.test.fair') as queue,
+        ):
+            service = Service(server.con, limit=1)
+            service.add_method('xibus.test.Service', 'Ping', asyncio.sleep)
+            done = []
+
+            async def ping(client):
+                args = ('xibus.test.fair', '/', None, 'Ping', (0.01,), 'd')
+                await client.con.call(*args)
+                done.append(client)
+
+            task = asyncio.create_task(service.serve(queue))
+            try:
+                await asyncio.wait_for(asyncio.gather(
+                    *[ping(busy) for _ in range(20)], ping(other)
+                ), 5)
+                self.assertLess(done.index(other), 5)
+            finally:
+                task.cancel()
+
+    async def test_call_out(self):
+        # handlers can make calls on the same connection while the
+        # service is saturated
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.callout') as queue,
+        ):
+            service = Service(server.con, limit=2)
+
+            @service.method('xibus.test.Service', sig='b')
+            async def Check():
+                (names,) = await server.con.call(
+                    'org.freedesktop.DBus',
+                    '/org/freedesktop/DBus',
+                    'org.freedesktop.DBus',
+                    'ListNames',
+                    (),
+                    '',
+                )
+                return 'xibus.test.callout' in names
+
+            task = asyncio.create_task(service.serve(queue))
+            try:
+                args = ('xibus.test.callout', '/', 'xibus.test.Service', 'Check')
+                results = await asyncio.wait_for(asyncio.gather(*[
+                    client.con.call(*args, (), '') for _ in range(100)
+                ]), 10)
+                self.assertEqual(results, [(True,)] * 100)
+            finally:
+                task.cancel()
+
+    async def test_send_error(self):
+        # a failed reply does not kill the worker
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.senderror') as queue,
+        ):
+            service = Service(server.con, limit=1)
+            service.add_method('xibus.test.Service', 'Ping', lambda: None)
+            send = server.con.send
+            failed = []
+
+            async def fail_once(*args):
+                if not failed:
+                    failed.append(True)
+                    raise ConnectionLostError('lost')
+                await send(*args)
+
+            task = asyncio.create_task(service.serve(queue))
+            try:
+                args = ('xibus.test.senderror', '/', None, 'Ping', (), '')
+                with mock.patch.object(server.con, 'send', fail_once):
+                    with self.assertRaises(CallTimeoutError):
+                        await client.con.call(*args, timeout=0.2)
+                    self.assertEqual(await client.con.call(*args), ())
+            finally:
+                task.cancel()
+
+    async def test_export(self):
+        class Counter:
+            count = prop('xibus.test.Counter', 'i', default=0)
+            step = prop('xibus.test.Counter', 'i', access='readwrite', default=1)
+
+            @method('xibus.test.Counter', returns='i')
+            def Increment(self):
+                for _ in range(self.step):
+                    self.count += 1
+                self.Incremented(self.count)
+                return self.count
+
+            @signal('xibus.test.Counter', 'i')
+            def Incremented(self, count):
+                return count
+
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.export') as queue,
+        ):
+            service = Service(server.con, object_manager='/')
+            service.export('/counter', Counter())
+            task = asyncio.create_task(service.serve(queue))
+            try:
+                name = 'xibus.test.export'
+                schema = await client.introspect(name, '/')
+                self.assertEqual(schema.nodes, ['counter'])
+                iface = 'org.freedesktop.DBus.ObjectManager'
+                self.assertIn(iface, schema.interfaces)
+
+                await client.set_property(name, '/counter', None, 'step', 2)
+                with self.assertRaises(PropertyReadOnlyError):
+                    await client.set_property(name, '/counter', None, 'count', 2)
+                with self.assertRaises(InvalidArgsError):
+                    await client.set_property(
+                        name, '/counter', None, 'step', 'x', sig='s'
+                    )
+                async with (
+                    client.subscribe_signal(
+                        name,
+                        '/counter',
+                        'org.freedesktop.DBus.Properties',
+                        'PropertiesChanged',
+                    ) as changes,
+                    client.subscribe_signal(
+                        name, '/counter', None, 'Incremented'
+                    ) as incremented,
+                ):
+                    result = await client.call(name, None, None, 'Increment')
+                    self.assertEqual(result, 2)
+                    self.assertEqual(await anext(aiter(incremented)), (2,))
+                    # changes are merged into a single signal
+                    self.assertEqual(
+                        await anext(aiter(changes)),
+                        ('xibus.test.Counter', {'count': ('i', 2)}, []),
+                    )
+
+                result = await client.get_property(name, None, None, 'count')
+                self.assertEqual(result, 2)
+                (objects,) = await client.con.call(
+                    name, '/', iface, 'GetManagedObjects', (), ''
+                )
+                self.assertEqual(objects, {'/counter': {'xibus.test.Counter': {
+                    'count': ('i', 2),
+                    'step': ('i', 2),
+                }}})
+            finally:
+                task.cancel()
+
+
+class TestPropertiesEmitter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.con = Connection(None)
+        self.con.sock, self.peer = socket.socketpair()
+        self.con.sock.setblocking(False)
+        self.peer.setblocking(False)
+
+    async def asyncTearDown(self):
+        self.con.sock.close()
+        self.peer.close()
+
+    def recv(self):
+        msgs = []
+        buf = self.peer.recv(65536)
+        while buf:
+            msg, buf, _ = Msg.unmarshal(buf, [])
+            msgs.append(msg.body)
+        return msgs
+
+    async def test_tick(self):
+        emitter = PropertiesEmitter(self.con)
+        for i in range(10):
+            emitter.changed('/foo', 'org.example', 'a', 'i', i)
+        emitter.invalidated('/foo', 'org.example', 'b')
+        emitter.changed('/bar', 'org.example', 'a', 'i', 1)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.recv(), [
+            ('org.example', {'a': ('i', 9)}, ['b']),
+            ('org.example', {'a': ('i', 1)}, []),
+        ])
+        self.assertEqual(emitter.sent, 2)
+        self.assertEqual(emitter.coalesced, 9)
+
+    async def test_interval(self):
+        emitter = PropertiesEmitter(self.con, interval=0.05)
+        emitter.invalidated('/foo', 'org.example', 'a')
+        await asyncio.sleep(0.01)
+        emitter.changed('/foo', 'org.example', 'a', 'i', 1)
+        await asyncio.sleep(0.01)
+        with self.assertRaises(BlockingIOError):
+            self.peer.recv(65536)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.recv(), [('org.example', {'a': ('i', 1)}, [])])
+
+    async def test_error(self):
+        emitter = PropertiesEmitter(self.con)
+        emitter.changed('/foo', 'org.example', 'a', 'i', 'not an int')
+        emitter.changed('/bar', 'org.example', 'a', 'i', 1)
+        with mock.patch.object(self.con.loop, 'call_exception_handler') as handler:
+            emitter.flush()
+        handler.assert_called_once()
+        await asyncio.sleep(0)
+        self.assertEqual(self.recv(), [('org.example', {'a': ('i', 1)}, [])])
+        self.assertEqual(emitter.sent, 1)
+        self.assertEqual(emitter.failed, 1)
+
+    async def test_flush(self):
+        emitter = PropertiesEmitter(self.con, interval=10)
+        emitter.changed('/foo', 'org.example', 'a', 'i', 1)
+        emitter.flush()
+        self.assertIsNone(emitter.handle)
+        await asyncio.sleep(0)
+        self.assertEqual(self.recv(), [('org.example', {'a': ('i', 1)}, [])])
@@ -0,0 +1,135 @@
+import asyncio
+import unittest
+
+from xibus import get_client
+from xibus.errors import PropertyReadOnlyError
+from xibus.errors import UnknownInterfaceError
+from xibus.schema import Schema
+from xibus.service import Service
+from xibus.service import method
+from xibus.service import prop
+from xibus.service import signal
+from xibus.typed import TypedProxy
+from xibus.typed import generate_source
+from xibus.typed import proxy_classes
+
+
+class Counter:
+    count = prop('xibus.test.Counter', 'i', default=0)
+    step = prop('xibus.test.Counter', 'i', access='readwrite', default=1)
+
+    @method('xibus.test.Counter', args='s', returns='is')
+    def Increment(self, reason):
+        self.count += self.step
+        self.Incremented(self.count)
+        return self.count, reason
+
+    @method('xibus.test.Counter')
+    def Reset(self):
+        self.count = 0
+
+    @signal('xibus.test.Counter', 'i')
+    def Incremented(self, count):
+        return count
+
+
+class TestGenerate(unittest.TestCase):
+    def test_source(self):
+        schema = Schema()
+        schema.add_method('com.example.Foo', 'Bar', [('in', 's'), (None, 'i')], ['s'])
+        schema.add_property('com.example.Foo', 'Baz', 'as', 'read')
+        schema.add_signal('com.example.Foo', 'Changed', ['s'])
+        source = generate_source(schema)
+        self.assertIn('class ComExampleFoo(TypedProxy):', source)
+        self.assertIn('async def Bar(self, arg0, arg1, *, timeout=None):', source)
+
+        namespace = {}
+        exec(compile(source, 'proxies.py', 'exec'), namespace)  # noqa: S102
+        cls = namespace['ComExampleFoo']
+        self.assertEqual(cls.iface, 'com.example.Foo')
+        self.assertEqual(cls.Baz.sig, 'as')
+        self.assertEqual(cls.Changed.name, 'Changed')
+
+    def test_invalid_signature(self):
+        schema = Schema()
+        schema.add_method('com.example.Foo', 'Bar', ['a{s'], [])
+        with self.assertRaises(ValueError):
+            proxy_classes(schema)
+
+    def test_invalid_names(self):
+        for iface, member in [
+            ('com.example.Foo', "Foo = __import__('os').system('true'); Bar"),
+            ('com.example.Foo', 'Foo-Bar'),
+            ("com.example.Foo') or ('", 'Bar'),
+            ('Foo', 'Bar'),
+        ]:
+            schema = Schema()
+            schema.add_property(iface, member, 's', 'read')
+            with self.subTest(iface=iface, member=member):
+                with self.assertRaises(ValueError):
+                    proxy_classes(schema)
+                with self.assertRaises(ValueError):
+                    generate_source(schema)
+
+    def test_reserved_names(self):
+        schema = Schema()
+        schema.add_method('com.example.Foo', 'set_property', [], [])
+        schema.add_property('com.example.Foo', 'iface', 's', 'read')
+        schema.add_signal('com.example.Foo', 'class', [])
+        cls = proxy_classes(schema)['com.example.Foo']
+        self.assertEqual(cls.iface, 'com.example.Foo')
+        self.assertEqual(cls.iface_.name, 'iface')
+        self.assertIs(cls.set_property, TypedProxy.set_property)
+        self.assertTrue(callable(cls.set_property_))
+        self.assertEqual(cls.class_.name, 'class')
+        self.assertIn('    iface_ = ProxyProperty(', generate_source(schema))
+
+    def test_reuse(self):
+        schema = Schema()
+        schema.add_defaults()
+        classes = proxy_classes(schema)
+        self.assertIs(proxy_classes(schema), classes)
+        self.assertTrue(issubclass(
+            classes['org.freedesktop.DBus.Properties'], TypedProxy
+        ))
+
+
+class TestTypedProxy(unittest.IsolatedAsyncioTestCase):
+    async def test_proxy(self):
+        async with (
+            get_client('session') as server,
+            get_client('session') as client,
+            server.acquire_name('xibus.test.typed') as queue,
+        ):
+            service = Service(server.con)
+            service.export('/counter', Counter())
+            task = asyncio.create_task(service.serve(queue))
+            try:
+                counter = await client.typed_proxy(
+                    'xibus.test.typed', '/counter', 'xibus.test.Counter'
+                )
+                self.assertEqual(type(counter).__name__, 'XibusTestCounter')
+
+                await counter.set_property('step', 2)
+                self.assertEqual(await counter.step, 2)
+                with self.assertRaises(PropertyReadOnlyError):
+                    await counter.set_property('count', 2)
+
+                signals = counter.Incremented
+                first = asyncio.create_task(anext(signals))
+                while not client.subscriptions:
+                    await asyncio.sleep(0.01)
+                self.assertEqual(await counter.Increment('test'), (2, 'test'))
+                self.assertEqual(await asyncio.wait_for(first, 1), (2,))
+                await signals.aclose()
+                self.assertEqual(client.subscriptions, set())
+
+                self.assertIsNone(await counter.Reset())
+                self.assertEqual(await counter.count, 0)
+
+                with self.assertRaises(UnknownInterfaceError):
+                    await client.typed_proxy(
+                        'xibus.test.typed', '/counter', 'xibus.test.Unknown'
+                    )
+            finally:
+                task.cancel()
@@ -1,12 +1,38 @@
 import contextlib
 
+from .cache import get_cache_path
 from .client import MagicClient
 from .client import Proxy  # noqa
+from .connection import CallTimeoutError  # noqa
+from .connection import Connection
+from .connection import ConnectionLostError  # noqa
 from .connection import DBusError  # noqa
-from .connection import get_connection
+from .connection import Overflow  # noqa
+from .connection import deadline  # noqa
+from .connection import get_address
+from .connection import get_connection  # noqa
+from .errors import is_transient  # noqa
+from .pool import ConnectionPool  # noqa
+from .server import Server  # noqa
+from .service import Service  # noqa
 
 
 @contextlib.asynccontextmanager
-async def get_client(bus):
-    async with get_connection(bus) as con:
-        yield MagicClient(con)
+async def get_client(bus, *, cache=False, pool=None, reconnect=False):
+    # with a ConnectionPool, the connection stays open after the context
+    # exits and is reused by the next get_client() call
+    if pool is None:
+        connection = Connection(get_address(bus), reconnect=reconnect)
+    else:
+        connection = pool.connection(get_address(bus))
+    async with connection as con:
+        client = MagicClient(con)
+        try:
+            if cache:
+                async with client.persistent_cache(get_cache_path(bus)):
+                    yield client
+            else:
+                yield client
+        finally:
+            if pool is not None:
+                await client.close()
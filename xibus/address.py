@@ -0,0 +1,217 @@
+import asyncio
+import os
+import re
+import socket
+import uuid
+
+RE_TRANSPORT = re.compile(r'^[a-z]+:')
+SAFE = frozenset(
+    b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_/.\\*'
+)
+
+
+class AddressError(ValueError):
+    pass
+
+
+def unescape(value):
+    result = bytearray()
+    i = 0
+    raw = value.encode()
+    while i < len(raw):
+        if raw[i] == ord('%'):
+            try:
+                result.append(int(raw[i + 1:i + 3], 16))
+            except ValueError as e:
+                raise AddressError(value) from e
+            i += 3
+        else:
+            result.append(raw[i])
+            i += 1
+    return result.decode()
+
+
+def escape(value):
+    return ''.join(chr(b) if b in SAFE else f'%{b:02x}' for b in value.encode())
+
+
+def parse_address(address):
+    # returns a list of (transport, params) tuples
+    result = []
+    for entry in address.split(';'):
+        if not entry:
+            continue
+        transport, sep, rest = entry.partition(':')
+        if not sep or not transport:
+            raise AddressError(entry)
+        params = {}
+        for pair in rest.split(',') if rest else []:
+            key, sep, value = pair.partition('=')
+            if not sep or not key or key in params:
+                raise AddressError(entry)
+            params[key] = unescape(value)
+        result.append((transport, params))
+    return result
+
+
+def unparse_address(transport, params):
+    return transport + ':' + ','.join(
+        f'{key}={escape(value)}' for key, value in params.items()
+    )
+
+
+def get_listen_addr(address):
+    # returns the socket address to bind and the address for clients
+    if address.startswith('\0'):
+        return address, unparse_address('unix', {'abstract': address[1:]})
+    elif not RE_TRANSPORT.match(address):
+        return address, unparse_address('unix', {'path': address})
+    transport, params = parse_address(address)[0]
+    if transport != 'unix':
+        raise AddressError(f'Cannot listen on {transport}')
+    if 'path' in params:
+        path = params['path']
+    elif 'abstract' in params:
+        return '\0' + params['abstract'], unparse_address('unix', params)
+    elif 'runtime' in params:
+        path = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'bus')
+    elif 'tmpdir' in params or 'dir' in params:
+        tmpdir = params.get('tmpdir', params.get('dir'))
+        path = os.path.join(tmpdir, f'dbus-{uuid.uuid4().hex[:10]}')
+    else:
+        raise AddressError(address)
+    return path, unparse_address('unix', {'path': path})
+
+
+async def _open_unix(params):
+    if 'path' in params:
+        addr = params['path']
+    elif 'abstract' in params:
+        addr = '\0' + params['abstract']
+    else:
+        # tmpdir, dir and runtime are only valid for listening
+        raise AddressError(params)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, addr)
+    except BaseException:
+        sock.close()
+        raise
+    return sock, None
+
+
+async def _open_tcp(params):
+    loop = asyncio.get_running_loop()
+    family = {
+        'ipv4': socket.AF_INET,
+        'ipv6': socket.AF_INET6,
+    }.get(params.get('family'), socket.AF_UNSPEC)
+    infos = await loop.getaddrinfo(
+        params.get('host', 'localhost'),
+        int(params.get('port', 0)),
+        family=family,
+        type=socket.SOCK_STREAM,
+    )
+    errors = []
+    for family, typ, proto, _, addr in infos:
+        sock = socket.socket(family, typ, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, addr)
+        except OSError as e:
+            sock.close()
+            errors.append(e)
+            continue
+        except BaseException:
+            sock.close()
+            raise
+        return sock, None
+    raise ConnectionError(params, errors)
+
+
+async def _open_unixexec(params):
+    args = [params.get('argv0', params['path'])]
+    i = 1
+    while f'argv{i}' in params:
+        args.append(params[f'argv{i}'])
+        i += 1
+    sock, child = socket.socketpair()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args, executable=params['path'], stdin=child, stdout=child
+        )
+    except BaseException:
+        sock.close()
+        raise
+    finally:
+        child.close()
+    sock.setblocking(False)
+    return sock, process
+
+
+TRANSPORTS = {
+    'unix': _open_unix,
+    'tcp': _open_tcp,
+    'unixexec': _open_unixexec,
+}
+
+
+async def open_transport(transport, params, timeout=None):
+    if transport not in TRANSPORTS:
+        raise AddressError(f'Unsupported transport: {transport}')
+    return await asyncio.wait_for(TRANSPORTS[transport](params), timeout)
+
+
+def _close(result):
+    sock, process = result
+    sock.close()
+    if process and process.returncode is None:
+        process.kill()
+
+
+def _discard(task):
+    # close the socket even if the task finishes after cancel()
+    def callback(task):
+        if not task.cancelled() and not task.exception():
+            _close(task.result())
+
+    task.cancel()
+    task.add_done_callback(callback)
+
+
+async def open_address(address, *, delay=0.25, timeout=None):
+    # Fallback addresses are tried in parallel, each one starting `delay`
+    # seconds after the previous one or as soon as it failed ("happy
+    # eyeballs"). Returns (sock, process, address) for the first one
+    # that succeeds.
+    if RE_TRANSPORT.match(address):
+        entries = parse_address(address)
+    else:
+        entries = [('unix', {'path': address})]
+
+    remaining = list(entries)
+    pending = {}
+    errors = []
+    try:
+        while remaining or pending:
+            if remaining:
+                entry = remaining.pop(0)
+                task = asyncio.create_task(open_transport(*entry, timeout))
+                pending[task] = entry
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                entry = pending.pop(task)
+                if task.exception():
+                    errors.append(task.exception())
+                else:
+                    sock, process = task.result()
+                    return sock, process, unparse_address(*entry)
+        raise ConnectionError(f'Could not connect to {address}', errors)
+    finally:
+        for task in pending:
+            _discard(task)
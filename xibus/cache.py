@@ -0,0 +1,113 @@
+import collections
+import json
+import os
+import time
+import weakref
+
+CACHE_VERSION = 1
+
+_shared_caches = weakref.WeakValueDictionary()
+
+
+class IntrospectCache:
+    # LRU cache for parsed introspection data, keyed by (name, path)
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = collections.OrderedDict()
+        # name -> cached paths, so invalidation does not scan everything
+        self.names = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        try:
+            value, expires = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        if expires is not None and expires < time.monotonic():
+            self._discard(key)
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self.data[key] = (value, expires)
+        self.data.move_to_end(key)
+        self.names.setdefault(key[0], set()).add(key[1])
+        while len(self.data) > self.maxsize:
+            self._discard(next(iter(self.data)))
+            self.evictions += 1
+
+    def _discard(self, key):
+        self.data.pop(key, None)
+        paths = self.names.get(key[0])
+        if paths is not None:
+            paths.discard(key[1])
+            if not paths:
+                del self.names[key[0]]
+
+    def invalidate(self, name, paths=None):
+        cached = self.names.get(name, set())
+        if paths is not None:
+            cached = cached.intersection(paths)
+        for path in list(cached):
+            self._discard((name, path))
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def get_shared_cache(addr):
+    # schemas are shared between all clients that connect to the same bus
+    if addr is None:
+        # e.g. peers accepted by a Server, which are all different
+        return IntrospectCache()
+    cache = _shared_caches.get(addr)
+    if cache is None:
+        cache = IntrospectCache()
+        _shared_caches[addr] = cache
+    return cache
+
+
+def get_cache_path(bus):
+    base = os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'xibus', f'introspect-{bus}.json')
+
+
+def read_cache(path, bus_id):
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != CACHE_VERSION or data.get('bus_id') != bus_id:
+        return {}
+    return data['services']
+
+
+def write_cache(path, bus_id, services):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as fh:
+        json.dump({
+            'version': CACHE_VERSION,
+            'bus_id': bus_id,
+            'services': services,
+        }, fh)
+    os.replace(tmp, path)
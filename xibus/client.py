@@ -1,9 +1,36 @@
+import asyncio
+import collections
 import contextlib
+import dataclasses
 import enum
 import random
 
+from .cache import get_shared_cache
+from .cache import read_cache
+from .cache import write_cache
 from .connection import DBusError
+from .connection import MsgQueue
+from .connection import Overflow
+from .connection import deadline
+from .connection import detached_task
+from .errors import NameHasNoOwnerError
+from .errors import UnknownInterfaceError
+from .match import MatchRule
+from .message import MsgFlag
+from .message import MsgType
+from .pool import pinned
 from .schema import Schema
+from .typed import proxy_classes
+
+
+# maximum number of concurrent Introspect calls when building the index
+INTROSPECT_LIMIT = 16
+
+# expected signatures, anyone on the bus can send these signals
+INTERFACES_CHANGED = {
+    'InterfacesAdded': 'oa{sa{sv}}',
+    'InterfacesRemoved': 'oas',
+}
 
 
 class NameFlag(enum.IntEnum):
@@ -19,36 +46,143 @@ class RequestNameReply(enum.IntEnum):
     ALREADY_OWNER = 4
 
 
+def _call_args(name, path, iface, method, params=(), sig=None):
+    return name, path, iface, method, params, sig
+
+
+def properties_key(msg):
+    return msg.sender, msg.path, msg.body[0]
+
+
+def merge_properties(old, new):
+    iface, changed, invalidated = old.body
+    _, new_changed, new_invalidated = new.body
+    changed = {
+        key: value for key, value in changed.items() if key not in new_invalidated
+    }
+    changed.update(new_changed)
+    invalidated = [
+        key for key in [*invalidated, *new_invalidated] if key not in changed
+    ]
+    return dataclasses.replace(
+        new, body=(iface, changed, list(dict.fromkeys(invalidated)))
+    )
+
+
 class SignalQueue:
-    def __init__(self, queue, sender, path, iface, signal):
+    def __init__(self, queue, name):
         self.queue = queue
-        self.sender = sender
-        self.path = path
-        self.iface = iface
-        self.signal = signal
+        self.name = name
 
     @property
     def rule(self):
-        return ','.join(
-            f"{key}='{value}'"
-            for key, value in {
-                'type': 'signal',
-                'sender': self.sender,
-                'path': self.path,
-                'interface': self.iface,
-                'member': self.signal,
-            }.items()
-        )
+        # the sender might change on reconnect
+        return self.queue.rule
 
     async def __aiter__(self):
         async for msg in self.queue:
-            if (
-                msg.sender == self.sender
-                and msg.path == self.path
-                and msg.iface == self.iface
-                and msg.member == self.signal
-            ):
-                yield msg.body
+            yield msg.body
+
+
+class PropertyCache:
+    # Mirrors all properties of a single interface. Watchers receive dicts
+    # of updated values and None if the cache stopped due to an error.
+
+    def __init__(self, client, name, path, iface):
+        self.client = client
+        self.key = (name, path, iface)
+        self.values = {}
+        self.watchers = set()
+        self.refs = 0
+        self.task = None
+        self.ready = None
+
+    async def _fetch(self, props):
+        name, path, iface = self.key
+        iprop = 'org.freedesktop.DBus.Properties'
+        calls = [(name, path, iprop, 'Get', (iface, prop), 'ss') for prop in props]
+        updates = {}
+        async for i, result in self.client.con.call_many(
+            calls, return_exceptions=True
+        ):
+            updates[props[i]] = None if isinstance(result, Exception) else result[0][1]
+        return updates
+
+    def _notify(self, updates):
+        for queue in self.watchers:
+            queue.put_nowait(updates)
+
+    async def refresh(self):
+        name, path, iface = self.key
+        iprop = 'org.freedesktop.DBus.Properties'
+        (values,) = await self.client.con.call(
+            name, path, iprop, 'GetAll', [iface], 's'
+        )
+        updates = {key: value for key, (_, value) in values.items()}
+        self.values.update(updates)
+        self._notify(updates)
+
+    async def _run(self):
+        name, path, iface = self.key
+        iprop = 'org.freedesktop.DBus.Properties'
+        async with self.client.subscribe_signal(
+            name,
+            path,
+            iprop,
+            'PropertiesChanged',
+            overflow=Overflow.COALESCE,
+            key=properties_key,
+            merge=merge_properties,
+        ) as queue:
+            (values,) = await self.client.con.call(
+                name, path, iprop, 'GetAll', [iface], 's'
+            )
+            self.values = {key: value for key, (_, value) in values.items()}
+            self.ready.set_result(None)
+
+            async for _iface, changed, invalidated in queue:
+                if _iface != iface:
+                    continue
+                updates = {key: value for key, (_, value) in changed.items()}
+                if invalidated:
+                    updates.update(await self._fetch(invalidated))
+                self.values.update(updates)
+                self._notify(updates)
+
+    def _on_done(self, task):
+        self.values = {}
+        if not self.ready.done():
+            if task.cancelled():
+                self.ready.cancel()
+            else:
+                self.ready.set_exception(task.exception())
+        self._notify(None)
+
+    async def start(self):
+        if self.task is None:
+            self.ready = asyncio.get_running_loop().create_future()
+            self.task = detached_task(self._run())
+            self.task.add_done_callback(self._on_done)
+        await asyncio.shield(self.ready)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, DBusError, OSError):
+                await self.task
+
+    @contextlib.contextmanager
+    def watch(self):
+        queue = MsgQueue(
+            overflow=Overflow.COALESCE,
+            key=lambda updates: updates is not None or None,
+            merge=lambda old, new: {**old, **new},
+        )
+        self.watchers.add(queue)
+        try:
+            yield queue
+        finally:
+            self.watchers.discard(queue)
 
 
 class Proxy:
@@ -56,32 +190,85 @@ class Proxy:
         self.client = client
         self.defaults = (name, path, iface)
 
-    async def call(self, method, params=(), sig=None):
-        return await self.client.call(*self.defaults, method, params, sig)
+    async def call(self, method, params=(), sig=None, *, timeout=None):
+        return await self.client.call(
+            *self.defaults, method, params, sig, timeout=timeout
+        )
+
+    async def call_many(self, calls, **kwargs):
+        calls = [(*self.defaults, *call) for call in calls]
+        async for i, result in self.client.call_many(calls, **kwargs):
+            yield i, result
 
     @contextlib.asynccontextmanager
-    async def subscribe_signal(self, signal):
-        async with self.client.subscribe_signal(*self.defaults, signal) as queue:
+    async def subscribe_signal(self, signal, **kwargs):
+        async with self.client.subscribe_signal(
+            *self.defaults, signal, **kwargs
+        ) as queue:
             yield queue
 
-    async def get_property(self, prop):
-        return await self.client.get_property(*self.defaults, prop)
+    async def get_property(self, prop, *, timeout=None):
+        return await self.client.get_property(*self.defaults, prop, timeout=timeout)
 
-    async def set_property(self, prop, value, sig=None):
-        return await self.client.set_property(*self.defaults, prop, value, sig)
+    async def set_property(self, prop, value, sig=None, *, timeout=None):
+        return await self.client.set_property(
+            *self.defaults, prop, value, sig, timeout=timeout
+        )
 
     async def watch_property(self, prop):
-        async for value in self.client.watch_property(*self.defaults, prop):
-            yield value
+        async with contextlib.aclosing(
+            self.client.watch_property(*self.defaults, prop)
+        ) as values:
+            async for value in values:
+                yield value
 
     async def portal_call(self, method, params=()):
         return await self.client.portal_call(*self.defaults, method, params)
 
 
+def get_ancestors(path):
+    parts = path.rstrip('/').split('/')
+    return ['/'.join(parts[:i]) or '/' for i in range(len(parts), 0, -1)]
+
+
+def name_owner_rule(name):
+    return MatchRule(
+        MsgType.SIGNAL,
+        sender='org.freedesktop.DBus',
+        path='/org/freedesktop/DBus',
+        iface='org.freedesktop.DBus',
+        member='NameOwnerChanged',
+        args=((0, name),),
+    )
+
+
+def object_manager_rules(owner):
+    return [
+        MatchRule(
+            MsgType.SIGNAL,
+            sender=owner,
+            iface='org.freedesktop.DBus.ObjectManager',
+            member=member,
+        )
+        for member in INTERFACES_CHANGED
+    ]
+
+
 class Client:
-    def __init__(self, con):
+    def __init__(self, con, cache=None):
         self.con = con
-        self.introspect_cache = {}
+        self.introspect_cache = (
+            cache if cache is not None else get_shared_cache(con.addr)
+        )
+        self.handlers = {}
+        self.disk_cache = None
+        self.disk_cache_dirty = False
+        self.owners = {}
+        self.property_caches = {}
+        self.matches = {}
+        self.subscriptions = set()
+        self.names = set()
+        con.reconnect_callbacks.append(self._on_reconnect)
         self.bus = Proxy(
             self,
             'org.freedesktop.DBus',
@@ -89,77 +276,392 @@ class Client:
             'org.freedesktop.DBus',
         )
 
+    async def _get_owner(self, name):
+        if name.startswith(':'):
+            return name
+        if name not in self.owners:
+            # keep self.owners up to date
+            await self._watch_name(name)
+            try:
+                (self.owners[name],) = await self.con.call(
+                    'org.freedesktop.DBus',
+                    '/org/freedesktop/DBus',
+                    'org.freedesktop.DBus',
+                    'GetNameOwner',
+                    [name],
+                    's',
+                )
+            except DBusError as e:
+                # do not remember errors that might go away
+                if e.transient:
+                    raise
+                self.owners[name] = None
+        return self.owners[name]
+
+    async def _get_disk_entry(self, name):
+        # unique names are never reused, so there is no point in storing them
+        if self.disk_cache is None or name.startswith(':'):
+            return None
+        owner = await self._get_owner(name)
+        if owner is None:
+            return None
+        entry = self.disk_cache.get(name)
+        if not entry or entry['owner'] != owner:
+            entry = self.disk_cache[name] = {'owner': owner, 'objects': {}}
+        return entry
+
     async def introspect(self, name, path):
-        key = f'{name}{path}'
-        if key not in self.introspect_cache:
-            iface = 'org.freedesktop.DBus.Introspectable'
-            (xml,) = await self.con.call(name, path, iface, 'Introspect', [], '')
-            self.introspect_cache[key] = Schema.from_xml(xml)
-        return self.introspect_cache[key]
-
-    async def call(self, name, path, iface, method, params=(), sig=None):
+        key = (name, path)
+        await self._watch_objects(name)
+        schema = self.introspect_cache.get(key)
+        entry = await self._get_disk_entry(name)
+        if schema is None:
+            if entry and path in entry['objects']:
+                xml = entry['objects'][path]
+            else:
+                iface = 'org.freedesktop.DBus.Introspectable'
+                (xml,) = await self.con.call(name, path, iface, 'Introspect', [], '')
+                if entry:
+                    entry['objects'][path] = xml
+                    self.disk_cache_dirty = True
+            schema = Schema.from_xml(xml)
+            self.introspect_cache.set(key, schema)
+        elif entry and path not in entry['objects']:
+            # schema was shared by another client
+            entry['objects'][path] = schema.to_xml()
+            self.disk_cache_dirty = True
+        return schema
+
+    def invalidate(self, name, paths=None):
+        self.introspect_cache.invalidate(name, paths)
+        if paths is None:
+            # the old owner will not send any updates
+            for key, cache in self.property_caches.items():
+                if key[0] == name:
+                    cache.values = {}
+        if self.disk_cache and name in self.disk_cache:
+            if paths is None:
+                del self.disk_cache[name]
+            else:
+                objects = self.disk_cache[name]['objects']
+                for path in paths:
+                    objects.pop(path, None)
+            self.disk_cache_dirty = True
+
+    def _on_name_owner_changed(self, msg):
+        if msg.sig != 'sss':
+            return
+        name, old, new = msg.body
+        if name in self.owners:
+            self.owners[name] = new or None
+        self.invalidate(name)
+        if name.startswith(':') and not new:
+            # unique names are never reused
+            self._unwatch([name_owner_rule(name)])
+        if (
+            old
+            and old not in self.owners.values()
+            and name_owner_rule(old) not in self.handlers
+        ):
+            self._unwatch(object_manager_rules(old))
+
+    def _on_interfaces_changed(self, msg):
+        if msg.sig != INTERFACES_CHANGED.get(msg.member):
+            return
+        (path,) = msg.get_body(1)
+        paths = get_ancestors(path)
+        # the cache might use well-known names
+        self.invalidate(msg.sender, paths)
+        for name, owner in list(self.owners.items()):
+            if owner == msg.sender:
+                self.invalidate(name, paths)
+
+    async def _add_handler(self, rule, callback):
+        self.handlers[rule] = self.con.add_signal_handler(rule, callback)
+        await self.con.call(
+            'org.freedesktop.DBus',
+            '/org/freedesktop/DBus',
+            'org.freedesktop.DBus',
+            'AddMatch',
+            [str(rule)],
+            's',
+            MsgFlag.NO_REPLY_EXPECTED,
+        )
+
+    async def _remove_matches(self, rules):
+        # the bus forgets all rules of a lost connection anyway
+        with contextlib.suppress(OSError):
+            for rule in rules:
+                await self.con.call(
+                    'org.freedesktop.DBus',
+                    '/org/freedesktop/DBus',
+                    'org.freedesktop.DBus',
+                    'RemoveMatch',
+                    [str(rule)],
+                    's',
+                    MsgFlag.NO_REPLY_EXPECTED,
+                )
+
+    def _unwatch(self, rules):
+        rules = [rule for rule in rules if rule in self.handlers]
+        for rule in rules:
+            self.con.remove_signal_handler(rule, self.handlers.pop(rule))
+        if rules:
+            detached_task(self._remove_matches(rules))
+
+    async def _watch_name(self, name):
+        # only names that we actually use are watched
+        rule = name_owner_rule(name)
+        if rule not in self.handlers:
+            await self._add_handler(rule, self._on_name_owner_changed)
+
+    async def _watch_objects(self, name):
+        # object managers send signals from the unique name of their owner
+        await self._watch_name(name)
+        owner = await self._get_owner(name)
+        for rule in object_manager_rules(owner) if owner else []:
+            if rule not in self.handlers:
+                await self._add_handler(rule, self._on_interfaces_changed)
+
+    async def _on_reconnect(self):
+        # The bus has forgotten everything about us. Unique names might also
+        # have changed if the bus was restarted.
+        self.owners = {}
+        for rule in list(self.handlers):
+            await self.con.call(
+                'org.freedesktop.DBus',
+                '/org/freedesktop/DBus',
+                'org.freedesktop.DBus',
+                'AddMatch',
+                [str(rule)],
+                's',
+                MsgFlag.NO_REPLY_EXPECTED,
+            )
+
+        for sub in list(self.subscriptions):
+            sender = await self._get_owner(sub.name)
+            if sender is not None and sender != sub.rule.sender:
+                rule = dataclasses.replace(sub.rule, sender=sender)
+                self.con.update_rule(sub.queue, rule)
+        counts = collections.Counter(sub.rule for sub in self.subscriptions)
+        self.matches = {
+            rule: [count, asyncio.ensure_future(
+                self.bus.call('AddMatch', [str(rule)], 's')
+            )]
+            for rule, count in counts.items()
+        }
+        await asyncio.gather(
+            *[entry[1] for entry in self.matches.values()], return_exceptions=True
+        )
+
+        for name in list(self.names):
+            reply = await self.bus.call('RequestName', (name, NameFlag.DO_NOT_QUEUE))
+            if reply not in [
+                RequestNameReply.PRIMARY_OWNER, RequestNameReply.ALREADY_OWNER
+            ]:
+                # someone else took the name while we were disconnected
+                self.names.discard(name)
+                self.con.loop.call_exception_handler({
+                    'message': f'Lost name {name} on reconnect',
+                    'exception': DBusError('Failed to acquire name', name, reply),
+                })
+
+        await asyncio.gather(
+            *[cache.refresh() for cache in self.property_caches.values()],
+            return_exceptions=True,
+        )
+
+    async def close(self):
+        # connections may outlive the client (see ConnectionPool)
+        if self._on_reconnect in self.con.reconnect_callbacks:
+            self.con.reconnect_callbacks.remove(self._on_reconnect)
+        handlers, self.handlers = self.handlers, {}
+        for rule, handler in handlers.items():
+            self.con.remove_signal_handler(rule, handler)
+        await self._remove_matches(handlers)
+
+    @contextlib.asynccontextmanager
+    async def persistent_cache(self, path):
+        (bus_id,) = await self.con.call(
+            'org.freedesktop.DBus',
+            '/org/freedesktop/DBus',
+            'org.freedesktop.DBus',
+            'GetId',
+            [],
+            '',
+        )
+        self.disk_cache = read_cache(path, bus_id)
+        self.disk_cache_dirty = False
+        try:
+            yield
+        finally:
+            if self.disk_cache_dirty:
+                write_cache(path, bus_id, self.disk_cache)
+            self.disk_cache = None
+
+    async def _resolve_method(self, name, path, iface, method):
         schema = await self.introspect(name, path)
-        m = schema.interfaces[iface].methods[method]
-        if sig is None:
-            sig = ''.join([v for _, v in m.args])
+        return path, iface, schema.interfaces[iface].methods[method]
 
-        result = await self.con.call(name, path, iface, method, params, sig)
+    def _unpack_result(self, m, result):
         if len(m.returns) == 1:
             return result[0]
         elif len(m.returns) > 1:
             return result
 
+    async def call(
+        self, name, path, iface, method, params=(), sig=None, *, timeout=None
+    ):
+        # the timeout also covers introspection
+        with deadline(timeout):
+            path, iface, m = await self._resolve_method(name, path, iface, method)
+            if sig is None:
+                sig = ''.join([v for _, v in m.args])
+
+            result = await self.con.call(name, path, iface, method, params, sig)
+        return self._unpack_result(m, result)
+
+    async def call_many(self, calls, *, timeout=None, **kwargs):
+        # calls is an iterable of (name, path, iface, method, params, sig)
+        # tuples where params and sig are optional
+        resolved = {}
+        prepared = []
+        methods = []
+        with deadline(timeout) as when:
+            for call in calls:
+                name, path, iface, method, params, sig = _call_args(*call)
+                key = (name, path, iface, method)
+                if key not in resolved:
+                    resolved[key] = await self._resolve_method(*key)
+                path, iface, m = resolved[key]
+                if sig is None:
+                    sig = ''.join([v for _, v in m.args])
+                prepared.append((name, path, iface, method, params, sig))
+                methods.append(m)
+
+        if when is not None:
+            kwargs['timeout'] = when - asyncio.get_running_loop().time()
+        async for i, result in self.con.call_many(prepared, **kwargs):
+            if not isinstance(result, Exception):
+                result = self._unpack_result(methods[i], result)
+            yield i, result
+
+    async def _add_match(self, rule):
+        # identical rules share a single AddMatch
+        if rule not in self.matches:
+            self.matches[rule] = [0, detached_task(
+                self.bus.call('AddMatch', [str(rule)], 's')
+            )]
+        entry = self.matches[rule]
+        entry[0] += 1
+        try:
+            await asyncio.shield(entry[1])
+        except BaseException:
+            await self._remove_match(rule)
+            raise
+
+    async def _remove_match(self, rule):
+        entry = self.matches.get(rule)
+        if entry is None:
+            # lost on reconnect
+            return
+        entry[0] -= 1
+        if entry[0]:
+            return
+        del self.matches[rule]
+        try:
+            await entry[1]
+        except DBusError:
+            return
+        await self.bus.call('RemoveMatch', [str(rule)], 's')
+
     @contextlib.asynccontextmanager
-    async def subscribe_signal(self, name, path, iface, signal):
-        # NOTE: if we register the same match rule twice and then remove one of
-        # them, the other still exists on the bus. So we do not need any
-        # special handling on our end.
-
-        if not name.startswith(':'):
-            name = await self.bus.call('GetNameOwner', [name], 's')
-        with self.con.signal_queue() as queue:
-            sq = SignalQueue(queue, name, path, iface, signal)
-            await self.bus.call('AddMatch', [sq.rule], 's')
+    async def subscribe_signal(self, name, path, iface, signal, **kwargs):
+        sender = await self._get_owner(name)
+        if sender is None:
+            raise NameHasNoOwnerError('Name has no owner', name)
+        rule = MatchRule(
+            MsgType.SIGNAL, sender=sender, path=path, iface=iface, member=signal
+        )
+        with self.con.signal_queue(rule, **kwargs) as queue:
+            await self._add_match(rule)
+            sub = SignalQueue(queue, name)
+            self.subscriptions.add(sub)
             try:
-                yield sq
+                yield sub
             finally:
-                await self.bus.call('RemoveMatch', [sq.rule], 's')
+                self.subscriptions.discard(sub)
+                await self._remove_match(queue.rule)
 
     @contextlib.asynccontextmanager
-    async def acquire_name(self, name):
-        with self.con.call_queue(name) as queue:
+    async def acquire_name(self, name, **kwargs):
+        with self.con.call_queue(name, **kwargs) as queue:
             reply = await self.bus.call('RequestName', (name, NameFlag.DO_NOT_QUEUE))
             if reply != RequestNameReply.PRIMARY_OWNER:
                 raise DBusError('Failed to acquire name', name, reply)
+            self.names.add(name)
             try:
                 yield queue
             finally:
+                self.names.discard(name)
                 await self.bus.call('ReleaseName', (name,))
 
-    async def get_property(self, name, path, iface, prop):
+    @contextlib.asynccontextmanager
+    async def cache_properties(self, name, path, iface):
+        # while the context is active, get_property() is served locally
+        key = (name, path, iface)
+        if key not in self.property_caches:
+            self.property_caches[key] = PropertyCache(self, name, path, iface)
+        cache = self.property_caches[key]
+        cache.refs += 1
+        try:
+            await cache.start()
+            yield cache
+        finally:
+            cache.refs -= 1
+            if not cache.refs:
+                del self.property_caches[key]
+                await cache.stop()
+
+    async def get_property(self, name, path, iface, prop, *, timeout=None):
+        cache = self.property_caches.get((name, path, iface))
+        if cache and prop in cache.values:
+            return cache.values[prop]
         iprop = 'org.freedesktop.DBus.Properties'
-        result = await self.call(name, path, iprop, 'Get', (iface, prop), 'ss')
+        result = await self.call(
+            name, path, iprop, 'Get', (iface, prop), 'ss', timeout=timeout
+        )
         return result[1]
 
-    async def set_property(self, name, path, iface, prop, value, sig=None):
+    async def set_property(
+        self, name, path, iface, prop, value, sig=None, *, timeout=None
+    ):
         iprop = 'org.freedesktop.DBus.Properties'
-        if sig is None:
-            schema = await self.introspect(name, path)
-            sig = schema.interfaces[iface].properties[prop].type
-        await self.call(name, path, iprop, 'Set', (iface, prop, (sig, value)), 'ssv')
+        with deadline(timeout):
+            if sig is None:
+                schema = await self.introspect(name, path)
+                sig = schema.interfaces[iface].properties[prop].type
+            await self.call(
+                name, path, iprop, 'Set', (iface, prop, (sig, value)), 'ssv'
+            )
 
     async def watch_property(self, name, path, iface, prop):
-        iprop = 'org.freedesktop.DBus.Properties'
-        async with self.subscribe_signal(
-            name, path, iprop, 'PropertiesChanged'
-        ) as queue:
-            yield await self.get_property(name, path, iface, prop)
-            async for _iface, changed, invalidated in queue:
-                if _iface == iface:
-                    if prop in changed:
-                        yield changed[prop][1]
-                    elif prop in invalidated:
-                        yield None
+        # all watchers of an interface share a single subscription
+        async with self.cache_properties(name, path, iface) as cache:
+            with cache.watch() as queue:
+                yield await self.get_property(name, path, iface, prop)
+                async for updates in queue:
+                    if updates is None:
+                        await cache.task
+                    elif prop in updates:
+                        yield updates[prop]
+
+    async def typed_proxy(self, name, path, iface):
+        # classes are generated once per introspection result
+        schema = await self.introspect(name, path)
+        if iface not in schema.interfaces:
+            raise UnknownInterfaceError(f'Unknown interface {iface} on {path}')
+        return proxy_classes(schema)[iface](self, name, path)
 
     async def portal_call(self, name, path, iface, method, params=()):
         sender = self.con.unique_name.replace('.', '_')[1:]
@@ -173,7 +675,9 @@ class Client:
             'org.freedesktop.portal.Request',
             'Response',
         ) as queue:
-            await self.call(name, path, iface, method, params)
+            # the request path contains our unique name
+            with pinned():
+                await self.call(name, path, iface, method, params)
             async for status, value in queue:
                 if status != 0:
                     # I don't think there is any way to get a
@@ -183,13 +687,137 @@ class Client:
 
 
 class MagicClient(Client):
-    async def _iter_paths(self, name, path=''):
-        schema = await self.introspect(name, path or '/')
-        if schema.interfaces:
-            yield path or '/'
-        for child in schema.nodes:
-            async for p in self._iter_paths(name, f'{path}/{child}'):
-                yield p
+    def __init__(self, con, cache=None):
+        super().__init__(con, cache)
+        self.member_index = {}
+        self.iface_defs = {}
+        self.resolved = {}
+        self.introspect_limit = asyncio.Semaphore(INTROSPECT_LIMIT)
+
+    def invalidate(self, name, paths=None):
+        super().invalidate(name, paths)
+        # changes to individual objects are applied to the index in
+        # _on_interfaces_changed()
+        if paths is None:
+            self.member_index.pop(name, None)
+        for key in [key for key in self.resolved if key[0] == name]:
+            del self.resolved[key]
+
+    async def _on_reconnect(self):
+        # owners might have changed while we were disconnected
+        self.member_index = {}
+        self.iface_defs = {}
+        self.resolved = {}
+        await super()._on_reconnect()
+
+    def _on_interfaces_changed(self, msg):
+        super()._on_interfaces_changed(msg)
+        if msg.sig != INTERFACES_CHANGED.get(msg.member):
+            return
+        path, ifaces = msg.body
+        for name, task in list(self.member_index.items()):
+            if msg.sender not in [name, self.owners.get(name)]:
+                continue
+            for key in [key for key in self.resolved if key[0] == name]:
+                del self.resolved[key]
+            if (
+                not task.done()
+                or task.cancelled()
+                or task.exception()
+                or any(iface not in self.iface_defs[name] for iface in ifaces)
+            ):
+                del self.member_index[name]
+                continue
+            index = task.result()
+            for iface in ifaces:
+                s = self.iface_defs[name][iface]
+                for key in ['methods', 'signals', 'properties']:
+                    for value in getattr(s, key):
+                        candidates = index.setdefault((key, value), [])
+                        if msg.member == 'InterfacesRemoved':
+                            if (path, iface) in candidates:
+                                candidates.remove((path, iface))
+                        elif (path, iface) not in candidates:
+                            candidates.append((path, iface))
+
+    async def _collect_managed(self, name, path, schema):
+        # a single GetManagedObjects call returns all objects below path.
+        # We only need to introspect one object per interface.
+        (objects,) = await self.con.call(
+            name,
+            path,
+            'org.freedesktop.DBus.ObjectManager',
+            'GetManagedObjects',
+            [],
+            '',
+        )
+        samples = {}
+        for p, ifaces in sorted(objects.items()):
+            for iface in ifaces:
+                samples.setdefault(iface, p)
+        sample_paths = list(dict.fromkeys(samples.values()))
+        schemas = dict(zip(
+            sample_paths,
+            await asyncio.gather(
+                *[self._introspect_limited(name, p) for p in sample_paths]
+            ),
+            strict=True,
+        ))
+
+        result = [(path, schema.interfaces)] if schema.interfaces else []
+        for p, ifaces in sorted(objects.items()):
+            result.append((p, {
+                iface: schemas[samples[iface]].interfaces[iface]
+                for iface in ifaces
+                if iface in schemas[samples[iface]].interfaces
+            }))
+        return result
+
+    async def _introspect_limited(self, name, path):
+        # large trees would otherwise run into the bus' limit of pending
+        # replies per connection
+        async with self.introspect_limit:
+            return await self.introspect(name, path)
+
+    async def _collect_paths(self, name, path=''):
+        # introspect children concurrently, but keep depth-first order
+        schema = await self._introspect_limited(name, path or '/')
+        if 'org.freedesktop.DBus.ObjectManager' in schema.interfaces:
+            return await self._collect_managed(name, path or '/', schema)
+        children = await asyncio.gather(*[
+            self._collect_paths(name, f'{path}/{child}') for child in schema.nodes
+        ])
+        result = [(path or '/', schema.interfaces)] if schema.interfaces else []
+        for child in children:
+            result += child
+        return result
+
+    async def _build_index(self, name):
+        index = {}
+        defs = {}
+        _, paths = await asyncio.gather(
+            self._get_owner(name), self._collect_paths(name)
+        )
+        for path, interfaces in paths:
+            for iface, s in interfaces.items():
+                defs.setdefault(iface, s)
+                for key in ['methods', 'signals', 'properties']:
+                    for value in getattr(s, key):
+                        index.setdefault((key, value), []).append((path, iface))
+        self.iface_defs[name] = defs
+        return index
+
+    async def _get_index(self, name):
+        if name not in self.member_index:
+            self.member_index[name] = detached_task(self._build_index(name))
+        task = self.member_index[name]
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            # try again on the next call
+            if self.member_index.get(name) is task:
+                del self.member_index[name]
+            raise
 
     async def _guess_iface(self, name, key, value, path, iface=None):
         if iface:
@@ -201,34 +829,56 @@ class MagicClient(Client):
         raise ValueError((name, key, value, path))
 
     async def _guess_path(self, name, key, value, path=None, iface=None):
-        if path:
-            return path, await self._guess_iface(name, key, value, path, iface)
-        async for path in self._iter_paths(name):
-            try:
-                return path, await self._guess_iface(name, key, value, path, iface)
-            except ValueError:
-                pass
-        raise ValueError((name, key, value))
-
-    async def call(self, name, path, iface, method, params=(), sig=None):
+        if path and iface:
+            return path, iface
+        memo_key = (name, key, value, path, iface)
+        if memo_key not in self.resolved:
+            if path:
+                result = path, await self._guess_iface(name, key, value, path)
+            else:
+                index = await self._get_index(name)
+                candidates = [
+                    (p, i) for p, i in index.get((key, value), []) if iface in [None, i]
+                ]
+                if not candidates:
+                    raise ValueError((name, key, value))
+                result = candidates[0]
+            self.resolved[memo_key] = result
+        return self.resolved[memo_key]
+
+    async def _resolve_method(self, name, path, iface, method):
         path, iface = await self._guess_path(name, 'methods', method, path, iface)
-        return await super().call(name, path, iface, method, params, sig)
+        return await super()._resolve_method(name, path, iface, method)
 
     @contextlib.asynccontextmanager
-    async def subscribe_signal(self, name, path, iface, signal):
+    async def subscribe_signal(self, name, path, iface, signal, **kwargs):
         path, iface = await self._guess_path(name, 'signals', signal, path, iface)
-        async with super().subscribe_signal(name, path, iface, signal) as queue:
+        async with super().subscribe_signal(
+            name, path, iface, signal, **kwargs
+        ) as queue:
             yield queue
 
-    async def get_property(self, name, path, iface, prop):
-        path, iface = await self._guess_path(name, 'properties', prop, path, iface)
-        return await super().get_property(name, path, iface, prop)
-
-    async def set_property(self, name, path, iface, prop, value, sig=None):
-        path, iface = await self._guess_path(name, 'properties', prop, path, iface)
-        await super().set_property(name, path, iface, prop, value, sig)
+    async def get_property(self, name, path, iface, prop, *, timeout=None):
+        with deadline(timeout):
+            path, iface = await self._guess_path(
+                name, 'properties', prop, path, iface
+            )
+            return await super().get_property(name, path, iface, prop)
+
+    async def set_property(
+        self, name, path, iface, prop, value, sig=None, *, timeout=None
+    ):
+        with deadline(timeout):
+            path, iface = await self._guess_path(
+                name, 'properties', prop, path, iface
+            )
+            await super().set_property(name, path, iface, prop, value, sig)
 
     async def watch_property(self, name, path, iface, prop):
         path, iface = await self._guess_path(name, 'properties', prop, path, iface)
-        async for value in super().watch_property(name, path, iface, prop):
-            yield value
+        # make sure the shared subscription is released on aclose()
+        async with contextlib.aclosing(
+            super().watch_property(name, path, iface, prop)
+        ) as values:
+            async for value in values:
+                yield value
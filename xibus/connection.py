@@ -1,87 +1,527 @@
+import array
 import asyncio
+import collections
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
 import os
+import random
 import re
 import socket
 from contextlib import contextmanager
 
+from .address import open_address
+from .errors import CallTimeoutError
+from .errors import DBusError
+from .errors import UnknownObjectError
+from .errors import from_reply
+from .errors import get_error_name
+from .match import MatchRule
+from .match import MatchTable
 from .message import Msg
 from .message import MsgFlag
 from .message import MsgType
+from .message import get_msg_size
 
 RE_PATH = re.compile(r'^/[A-Za-z0-9_/]*$')
+RECV_SIZE = 65536
+MAX_FDS = 255
+SCM_MAX_FD = 253
+IOV_MAX = 1024
+MAX_HELD = 1024
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX_DELAY = 30
+# same default as libdbus
+CALL_TIMEOUT = 25
 
+_deadline = contextvars.ContextVar('xibus_deadline', default=None)
 
-class DBusError(Exception):
+
+class InvalidPathError(ValueError):
     pass
 
 
-class InvalidPathError(ValueError):
+class ConnectionLostError(ConnectionError):
     pass
 
 
-async def iter_queue(queue):
-    while True:
-        item = await queue.get()
-        try:
-            yield item
-        finally:
-            queue.task_done()
+@contextmanager
+def deadline(timeout):
+    # All calls in this context share a common deadline, including the ones
+    # made by helpers like introspection. Nested deadlines can only make it
+    # shorter. Yields the absolute deadline in loop time (or None).
+    when = _deadline.get()
+    if timeout is not None:
+        own = asyncio.get_running_loop().time() + timeout
+        if when is None or own < when:
+            when = own
+    token = _deadline.set(when)
+    try:
+        yield when
+    finally:
+        _deadline.reset(token)
+
+
+def detached_task(coro):
+    # tasks that are shared between callers must not inherit the deadline
+    # of whoever happened to start them
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    return context.run(asyncio.ensure_future, coro)
+
+
+class Overflow(enum.Enum):
+    DROP_OLDEST = enum.auto()
+    DROP_NEWEST = enum.auto()
+    COALESCE = enum.auto()
+    PAUSE = enum.auto()
+
+
+class MsgQueue:
+    def __init__(
+        self, maxsize=32, overflow=Overflow.DROP_OLDEST, key=None, merge=None
+    ):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.key = key
+        self.merge = merge
+        self.items = collections.deque()
+        self.keys = {}
+        self.event = asyncio.Event()
+        self.paused = False
+        self.dropped = 0
+        self.coalesced = 0
+
+        # set by Connection.signal_queue()
+        self.rule = None
+
+        # set by Connection
+        self.on_pause = None
+        self.on_resume = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def put_nowait(self, item):
+        key = None
+        if self.overflow == Overflow.COALESCE:
+            # items with the same key are always merged, even if the
+            # queue is not full
+            key = self.key(item)
+            if key is not None and key in self.keys:
+                entry = self.keys[key]
+                entry[0] = self.merge(entry[0], item)
+                self.coalesced += 1
+                return
+
+        if len(self.items) >= self.maxsize:
+            if self.overflow == Overflow.DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self.overflow != Overflow.PAUSE:
+                self._pop()
+                self.dropped += 1
+
+        entry = [item, key]
+        self.items.append(entry)
+        if key is not None:
+            self.keys[key] = entry
+        self.event.set()
+
+        if (
+            self.overflow == Overflow.PAUSE
+            and not self.paused
+            and len(self.items) >= self.maxsize
+        ):
+            self.paused = True
+            if self.on_pause:
+                self.on_pause(self)
+
+    def _pop(self):
+        entry = self.items.popleft()
+        item, key = entry
+        if key is not None and self.keys.get(key) is entry:
+            del self.keys[key]
+        return item
+
+    async def get(self):
+        while not self.items:
+            self.event.clear()
+            await self.event.wait()
+        item = self._pop()
+        if self.paused and len(self.items) < self.maxsize:
+            self.paused = False
+            if self.on_resume:
+                self.on_resume(self)
+        return item
+
+    async def __aiter__(self):
+        while True:
+            yield await self.get()
+
+
+class SignalHandler:
+    # can be used in place of a queue to handle signals synchronously
+    def __init__(self, callback):
+        self.put_nowait = callback
 
 
 class Connection:
-    def __init__(self, addr, loop=None):
+    def __init__(
+        self,
+        addr,
+        loop=None,
+        *,
+        eager_send=False,
+        bus=True,
+        timeout=None,
+        reconnect=False,
+        call_timeout=CALL_TIMEOUT,
+    ):
         self.addr = addr
         self.loop = loop
+        self.bus = bus
+        self.timeout = timeout
+        self.call_timeout = call_timeout
+        self.reconnect = reconnect
         self.serial = 0
-        self.send_queue = []
+        self.send_queue = collections.deque()
+        self.drained = None
+        self.eager_send = eager_send
         self.replies = {}
+        self.deadlines = []
+        self.timer = None
         self.call_queues = {}
-        self.signal_queues = set()
+        self.match_table = MatchTable()
+        self.paused_queues = set()
+        self.held = collections.deque()
+        self.reading = True
+        self.recv_buf = bytearray(RECV_SIZE)
+        self.recv_len = 0
+        self.recv_fds = []
 
         if not self.loop:
             self.loop = asyncio.get_running_loop()
 
         # set in __aenter__()
         self.sock = None
+        self.process = None
+        self.address = None
         self.unique_name = None
 
+        self.connected = asyncio.Event()
+        self.closing = False
+        self.reconnect_task = None
+        self.reconnect_callbacks = []
+        self.lost_at = None
+        self.disconnects = 0
+        self.reconnects = 0
+        self.reconnect_failures = 0
+        self.downtime = 0
+        self.timeouts = 0
+
+    @property
+    def stats(self):
+        return {
+            'disconnects': self.disconnects,
+            'reconnects': self.reconnects,
+            'reconnect_failures': self.reconnect_failures,
+            'downtime': self.downtime,
+            'pending': len(self.replies),
+            'timeouts': self.timeouts,
+        }
+
     def get_serial(self):
         self.serial += 1
         return self.serial
 
+    def _get_deadline(self, timeout=None):
+        if timeout is None:
+            timeout = self.call_timeout
+        when = _deadline.get()
+        if timeout is not None:
+            own = self.loop.time() + timeout
+            if when is None or own < when:
+                when = own
+        return when
+
+    def _add_deadline(self, serial, when):
+        # A single timer for all pending calls. Entries of calls that
+        # finished in time are skipped lazily.
+        if when is None:
+            return
+        if len(self.deadlines) > 2 * len(self.replies) + 64:
+            self.deadlines = [e for e in self.deadlines if e[1] in self.replies]
+            heapq.heapify(self.deadlines)
+        heapq.heappush(self.deadlines, (when, serial))
+        if self.timer is None or when < self.timer.when():
+            if self.timer:
+                self.timer.cancel()
+            self.timer = self.loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        now = self.loop.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, serial = heapq.heappop(self.deadlines)
+            future = self.replies.pop(serial, None)
+            if future and not future.done():
+                future.set_exception(CallTimeoutError(
+                    CallTimeoutError.name, 'Did not receive a reply in time'
+                ))
+                self.timeouts += 1
+        while self.deadlines and self.deadlines[0][1] not in self.replies:
+            heapq.heappop(self.deadlines)
+        if self.deadlines:
+            self.timer = self.loop.call_at(self.deadlines[0][0], self._on_timer)
+
+    def _cancel_timer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.deadlines = []
+
+    def _recv(self):
+        fds = array.array('i')
+        with memoryview(self.recv_buf) as view:
+            size, ancdata, _, _ = self.sock.recvmsg_into(
+                [view[self.recv_len:]], socket.CMSG_SPACE(MAX_FDS * fds.itemsize)
+            )
+        for level, typ, data in ancdata:
+            if level == socket.SOL_SOCKET and typ == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+        self.recv_len += size
+        self.recv_fds += fds
+        return size
+
     def on_read(self):
-        buf, fds, _, _ = socket.recv_fds(self.sock, 134217728, 255)
-        while buf:
-            msg, buf, fds = Msg.unmarshal(buf, fds)
-            if msg.reply_serial is not None:
-                if msg.reply_serial in self.replies:
-                    future = self.replies.pop(msg.reply_serial)
-                    future.set_result(msg)
-            elif msg.type == MsgType.METHOD_CALL:
-                self.call_queues[msg.destination].put_nowait(msg)
-            elif msg.type == MsgType.SIGNAL:
-                for queue in self.signal_queues:
-                    queue.put_nowait(msg)
+        try:
+            size = self._recv()
+        except OSError as e:
+            self._connection_lost(e)
+            return
+        if not size:
+            self._connection_lost()
+            return
+        try:
+            self._process()
+        except Exception as e:  # noqa: BLE001
+            # the rest of the stream cannot be parsed
+            self._connection_lost(e)
+
+    def _close_socket(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.loop.remove_writer(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+
+    def _connection_lost(self, exc=None):
+        # fail everything that is waiting for the connection instead of
+        # letting it hang forever
+        if self.sock is None:
+            return
+        self._close_socket()
+        self.unique_name = None
+        self.connected.clear()
+        self.disconnects += 1
+        self.lost_at = self.loop.time()
+
+        error = ConnectionLostError(self.address or self.addr)
+        error.__cause__ = exc
+        replies, self.replies = self.replies, {}
+        self._cancel_timer()
+        for future in replies.values():
+            if not future.done():
+                future.set_exception(error)
+        self.send_queue.clear()
+        if self.drained:
+            self._done_writing(error)
+        for fd in self.recv_fds:
+            os.close(fd)
+        self.recv_fds = []
+        self.recv_len = 0
+        self.held.clear()
+        self.reading = True
+
+        if self.reconnect and not self.closing and not self.reconnect_task:
+            self.reconnect_task = detached_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = RECONNECT_DELAY
+        try:
+            while True:
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                try:
+                    await self._open()
+                    break
+                except (OSError, AssertionError, DBusError):
+                    self._close_socket()
+                    self.reconnect_failures += 1
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            self.reconnects += 1
+            self.downtime += self.loop.time() - self.lost_at
+        finally:
+            self.reconnect_task = None
+
+        # e.g. replay match rules and names
+        for callback in list(self.reconnect_callbacks):
+            with contextlib.suppress(OSError, DBusError):
+                await callback()
+        self.connected.set()
+
+    def _process(self):
+        offset = 0
+        size = None
+        try:
+            with memoryview(self.recv_buf) as view:
+                while True:
+                    size = get_msg_size(view[offset:self.recv_len])
+                    if size is None or offset + size > self.recv_len:
+                        break
+                    msg, tail, self.recv_fds = Msg.unmarshal(
+                        view[offset:offset + size], self.recv_fds, lazy=True
+                    )
+                    # recv_buf cannot be resized while views are exported
+                    tail.release()
+                    offset += size
+                    try:
+                        self.on_msg(msg)
+                    except Exception as e:  # noqa: BLE001
+                        # one bad message must not stop the connection
+                        self.loop.call_exception_handler({
+                            'message': f'Failed to handle {msg.iface}.{msg.member}',
+                            'exception': e,
+                        })
+        finally:
+            # keep incomplete message for the next read
+            rest = self.recv_len - offset
+            self.recv_buf[:rest] = self.recv_buf[offset:self.recv_len]
+            self.recv_len = rest
+            if size is not None and size > len(self.recv_buf):
+                self.recv_buf.extend(bytes(size - len(self.recv_buf)))
+            elif rest == 0 and len(self.recv_buf) > RECV_SIZE:
+                self.recv_buf = bytearray(RECV_SIZE)
+
+    def on_msg(self, msg):
+        if msg.reply_serial is not None:
+            if msg.reply_serial in self.replies:
+                future = self.replies.pop(msg.reply_serial)
+                future.set_result(msg)
+        elif self.held or self.paused_queues:
+            # Replies are still needed while queues are paused, e.g. for
+            # calls made by handlers. Everything else is held back (in
+            # order) and we only stop reading if too much piles up.
+            self.held.append(msg)
+            if len(self.held) >= MAX_HELD and self.reading:
+                self.reading = False
+                self.loop.remove_reader(self.sock.fileno())
+        else:
+            self._dispatch(msg)
+
+    def _dispatch(self, msg):
+        if msg.type == MsgType.METHOD_CALL:
+            queue = self.call_queues.get(msg.destination)
+            if queue is None:
+                # reply right away instead of letting the caller time out
+                self.send_error_nowait(
+                    msg, UnknownObjectError.name, f'No handler for {msg.path}'
+                )
+            else:
+                queue.put_nowait(msg)
+        elif msg.type == MsgType.SIGNAL:
+            # handlers may add or remove rules
+            for queue in list(self.match_table.lookup(msg)):
+                queue.put_nowait(msg)
+        else:
+            raise ValueError(msg)
+
+    def _flush(self):
+        # returns True if all pending data has been sent
+        while self.send_queue:
+            buffers = []
+            fds = []
+            for buf, entry_fds in self.send_queue:
+                # the first entry always fits (see send_nowait())
+                if buffers and (
+                    len(buffers) >= IOV_MAX or len(fds) + len(entry_fds) > SCM_MAX_FD
+                ):
+                    break
+                buffers.append(buf)
+                fds += entry_fds
+
+            ancdata = []
+            if fds:
+                ancdata.append(
+                    (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))
+                )
+            try:
+                size = self.sock.sendmsg(buffers, ancdata)
+            except BlockingIOError:
+                return False
+
+            # fds are sent along with the first byte
+            for i in range(len(buffers)):
+                self.send_queue[i][1] = []
+
+            while size:
+                buf = self.send_queue[0][0]
+                if size < len(buf):
+                    self.send_queue[0][0] = buf[size:]
+                    break
+                size -= len(buf)
+                self.send_queue.popleft()
+        return True
+
+    def _done_writing(self, exc=None):
+        drained, self.drained = self.drained, None
+        if exc:
+            drained.set_exception(exc)
+        else:
+            drained.set_result(None)
+
+    def _try_flush(self):
+        if self.sock is None:
+            return
+        try:
+            if self._flush():
+                self._done_writing()
             else:
-                raise ValueError(msg)
+                self.loop.add_writer(self.sock.fileno(), self.on_write)
+        except OSError as e:
+            self._connection_lost(e)
 
     def on_write(self):
-        if self.send_queue:
-            buf, fds, future = self.send_queue.pop(0)
-            size = socket.send_fds(self.sock, [buf], fds)
-            if size < len(buf):
-                self.send_queue.insert(0, (buf[size:], [], future))
+        try:
+            if self._flush():
+                self.loop.remove_writer(self.sock.fileno())
+                self._done_writing()
+        except OSError as e:
+            self._connection_lost(e)
+
+    def send_nowait(self, buf, fds=()):
+        if self.sock is None:
+            raise ConnectionLostError(self.address or self.addr)
+        if len(fds) > SCM_MAX_FD:
+            raise ValueError(f'Cannot send more than {SCM_MAX_FD} fds at once')
+        self.send_queue.append([memoryview(buf).cast('B'), list(fds)])
+        drained = self.drained
+        if drained is None:
+            drained = self.drained = self.loop.create_future()
+            if self.eager_send:
+                self._try_flush()
             else:
-                future.set_result(None)
-        else:
-            self.loop.remove_writer(self.sock.fileno())
+                # collect all messages from this loop iteration
+                self.loop.call_soon(self._try_flush)
+        return drained
 
-    async def send(self, buf, fds=[]):
-        if not self.send_queue:
-            self.loop.add_writer(self.sock.fileno(), self.on_write)
-        future = self.loop.create_future()
-        self.send_queue.append((buf, fds, future))
-        await future
+    async def send(self, buf, fds=()):
+        await asyncio.shield(self.send_nowait(buf, fds))
 
     async def recv(self, nbytes):
         return await self.loop.sock_recv(self.sock, nbytes)
@@ -91,64 +531,135 @@ class Connection:
         uid_encoded = str(uid).encode('ascii').hex()
         await self.send(f'AUTH EXTERNAL {uid_encoded}\r\n'.encode('ascii'))
         assert (await self.recv(128)).startswith(b'OK')
-        await self.send(b'NEGOTIATE_UNIX_FD\r\n')
-        assert (await self.recv(128)).startswith(b'AGREE_UNIX_FD')
+        if self.sock.family == socket.AF_UNIX:
+            # fd passing is not available on all transports (e.g. unixexec
+            # bridges), so we do not insist on it
+            await self.send(b'NEGOTIATE_UNIX_FD\r\n')
+            await self.recv(128)
         await self.send(b'BEGIN\r\n')
 
-    async def __aenter__(self):
-        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.sock.setblocking(False)  # noqa
-        await self.loop.sock_connect(self.sock, self.addr)
+    async def _open(self):
+        # connections accepted by a Server are already authenticated
+        if self.sock is None:
+            self.sock, self.process, self.address = await open_address(
+                self.addr, timeout=self.timeout
+            )
 
-        await self.send(b'\0')
-        await self.auth()
+            await self.send(b'\0')
+            await self.auth()
 
         self.loop.add_reader(self.sock.fileno(), self.on_read)
+        if self.recv_len:
+            # data that was received along with the auth handshake
+            self.loop.call_soon(self._process)
+
+        # peer-to-peer connections do not have a bus daemon
+        if self.bus:
+            (self.unique_name,) = await self.call(
+                'org.freedesktop.DBus',
+                '/org/freedesktop/DBus',
+                'org.freedesktop.DBus',
+                'Hello',
+                [],
+                '',
+            )
 
-        (self.unique_name,) = await self.call(
-            'org.freedesktop.DBus',
-            '/org/freedesktop/DBus',
-            'org.freedesktop.DBus',
-            'Hello',
-            [],
-            '',
-        )
-
+    async def __aenter__(self):
+        try:
+            await self._open()
+        except BaseException:
+            # e.g. auth or Hello failed
+            self._close_socket()
+            self._cancel_timer()
+            if self.process:
+                await self.process.wait()
+                self.process = None
+            raise
+        self.connected.set()
         return self
 
     async def __aexit__(self, *args, **kwargs):
+        self.closing = True
+        if self.reconnect_task:
+            self.reconnect_task.cancel()
+        self._cancel_timer()
         self.unique_name = None
-        self.loop.remove_reader(self.sock.fileno())
-        self.loop.remove_writer(self.sock.fileno())
-        self.sock.shutdown(socket.SHUT_RDWR)
-        self.sock.close()
-        self.sock = None
+        if self.sock:
+            with contextlib.suppress(OSError):
+                self.sock.shutdown(socket.SHUT_RDWR)
+            self._close_socket()
+        if self.drained:
+            # a scheduled _try_flush() will not do anything
+            self.send_queue.clear()
+            self._done_writing(ConnectionLostError(self.address or self.addr))
+        if self.process:
+            await self.process.wait()
+            self.process = None
+
+    def pause_reading(self, queue):
+        self.paused_queues.add(queue)
+
+    def resume_reading(self, queue):
+        self.paused_queues.discard(queue)
+        while self.held and not self.paused_queues:
+            self._dispatch(self.held.popleft())
+        if not self.held and not self.reading and self.sock:
+            self.reading = True
+            self.loop.add_reader(self.sock.fileno(), self.on_read)
 
     @contextmanager
-    def signal_queue(self, *, maxsize=32):
-        queue = asyncio.Queue(maxsize)
-        self.signal_queues.add(queue)
+    def _queue(self, **kwargs):
+        queue = MsgQueue(**kwargs)
+        queue.on_pause = self.pause_reading
+        queue.on_resume = self.resume_reading
         try:
-            yield iter_queue(queue)
+            yield queue
         finally:
-            self.signal_queues.remove(queue)
+            if queue in self.paused_queues:
+                self.resume_reading(queue)
+
+    def add_signal_handler(self, rule, callback):
+        handler = SignalHandler(callback)
+        self.match_table.add(rule, handler)
+        return handler
+
+    def remove_signal_handler(self, rule, handler):
+        self.match_table.remove(rule, handler)
+
+    @contextmanager
+    def signal_queue(self, rule=None, **kwargs):
+        if rule is None:
+            rule = MatchRule(MsgType.SIGNAL)
+        with self._queue(**kwargs) as queue:
+            queue.rule = rule
+            self.match_table.add(rule, queue)
+            try:
+                yield queue
+            finally:
+                self.match_table.remove(queue.rule, queue)
+
+    def update_rule(self, queue, rule):
+        self.match_table.remove(queue.rule, queue)
+        queue.rule = rule
+        self.match_table.add(rule, queue)
 
     @contextmanager
-    def call_queue(self, name, *, maxsize=32):
+    def call_queue(self, name, **kwargs):
         if name in self.call_queues:
             raise ValueError(name)
-        queue = asyncio.Queue(maxsize)
-        self.call_queues[name] = queue
-        try:
-            yield iter_queue(queue)
-        finally:
-            self.call_queues.pop(name)
-
-    async def call(self, dest, path, iface, method, body, sig, flags=MsgFlag.NONE):
+        kwargs.setdefault('overflow', Overflow.PAUSE)
+        with self._queue(**kwargs) as queue:
+            self.call_queues[name] = queue
+            try:
+                yield queue
+            finally:
+                self.call_queues.pop(name)
+
+    def _method_call(self, dest, path, iface, method, body, sig, flags=MsgFlag.NONE):
         if not RE_PATH.match(path):
             raise InvalidPathError(path)
 
-        request = Msg(
+        return Msg(
             MsgType.METHOD_CALL,
             self.get_serial(),
             destination=dest,
@@ -160,12 +671,27 @@ class Connection:
             flags=flags,
         )
 
+    def _get_reply(self, response):
+        if response.type == MsgType.METHOD_RETURN:
+            return response.body
+        elif response.type == MsgType.ERROR:
+            raise from_reply(response.error_name, response.body)
+        else:
+            raise ValueError(response.type)
+
+    async def call(
+        self, dest, path, iface, method, body, sig, flags=MsgFlag.NONE, *, timeout=None
+    ):
+        # timeout=None uses call_timeout, math.inf waits forever
+        request = self._method_call(dest, path, iface, method, body, sig, flags)
+
         if flags & MsgFlag.NO_REPLY_EXPECTED:
             await self.send(*request.marshal())
             return
 
         future = self.loop.create_future()
         self.replies[request.serial] = future
+        self._add_deadline(request.serial, self._get_deadline(timeout))
 
         try:
             await self.send(*request.marshal())
@@ -173,17 +699,59 @@ class Connection:
         finally:
             self.replies.pop(request.serial, None)
 
-        if response.type == MsgType.METHOD_RETURN:
-            return response.body
-        elif response.type == MsgType.ERROR:
-            e = DBusError(response.error_name)
-            if response.body and isinstance(response.body[0], str):
-                e.add_note(response.body[0])
-            raise e
-        else:
-            raise ValueError(response.type)
+        return self._get_reply(response)
+
+    async def call_many(
+        self, calls, *, limit=None, return_exceptions=False, timeout=None
+    ):
+        # yields (index, result) in the order in which replies arrive.
+        # An explicit timeout applies to the batch as a whole.
+        calls = enumerate(calls)
+        when = None if timeout is None else self._get_deadline(timeout)
+        pending = {}
+        done = asyncio.Queue()
+
+        def on_sent(drained, futures):
+            if not drained.cancelled() and drained.exception():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(drained.exception())
+
+        def fill():
+            n = None if limit is None else limit - len(pending)
+            futures = []
+            for i, call in itertools.islice(calls, n):
+                request = self._method_call(*call)
+                future = self.loop.create_future()
+                future.add_done_callback(lambda f, i=i: done.put_nowait((i, f)))
+                self.replies[request.serial] = future
+                self._add_deadline(request.serial, when or self._get_deadline())
+                pending[i] = request.serial
+                futures.append(future)
+                drained = self.send_nowait(*request.marshal())
+            if futures:
+                drained.add_done_callback(lambda d: on_sent(d, futures))
 
-    async def emit_signal(self, path, iface, signal, body, sig, flags=MsgFlag.NONE):
+        try:
+            fill()
+            while pending:
+                i, future = await done.get()
+                self.replies.pop(pending.pop(i), None)
+                try:
+                    result = self._get_reply(future.result())
+                except (DBusError, OSError) as e:
+                    if not return_exceptions:
+                        raise
+                    result = e
+                fill()
+                yield i, result
+        finally:
+            for serial in pending.values():
+                future = self.replies.pop(serial, None)
+                if future:
+                    future.cancel()
+
+    def emit_signal_nowait(self, path, iface, signal, body, sig, flags=MsgFlag.NONE):
         if not RE_PATH.match(path):
             raise InvalidPathError(path)
 
@@ -198,11 +766,34 @@ class Connection:
             flags=flags,
         )
 
-        await self.send(*msg.marshal())
+        return self.send_nowait(*msg.marshal())
+
+    async def emit_signal(self, path, iface, signal, body, sig, flags=MsgFlag.NONE):
+        drained = self.emit_signal_nowait(path, iface, signal, body, sig, flags)
+        await asyncio.shield(drained)
+
+    def _error(self, call, name, message):
+        return Msg(
+            MsgType.ERROR,
+            self.get_serial(),
+            reply_serial=call.serial,
+            destination=call.sender,
+            error_name=name,
+            body=(message,),
+            sig='s',
+        )
+
+    def send_error_nowait(self, call, name, message=''):
+        if call.flags & MsgFlag.NO_REPLY_EXPECTED:
+            return None
+        return self.send_nowait(*self._error(call, name, message).marshal())
 
     async def send_reply(self, call, handler):
+        # exceptions are converted to D-Bus errors, see errors.py
         try:
             sig, body = await handler(call)
+            if call.flags & MsgFlag.NO_REPLY_EXPECTED:
+                return
             reply = Msg(
                 MsgType.METHOD_RETURN,
                 self.get_serial(),
@@ -211,32 +802,28 @@ class Connection:
                 body=body,
                 sig=sig,
             )
+            # a wrong return value should also result in an error reply
+            buf, fds = reply.marshal()
         except Exception as e:
-            # TODO: better error conversion
-            # (what is the quivalent of 404 not found?)
-            reply = Msg(
-                MsgType.ERROR,
-                self.get_serial(),
-                reply_serial=call.serial,
-                destination=call.sender,
-                error_name='org.freedesktop.DBus.Error.AccessDenied',
-                body=(str(e),),
-                sig='s',
-            )
+            if call.flags & MsgFlag.NO_REPLY_EXPECTED:
+                return
+            buf, fds = self._error(call, get_error_name(e), str(e)).marshal()
 
-        if not call.flags & MsgFlag.NO_REPLY_EXPECTED:
-            await self.send(*reply.marshal())
+        await self.send(buf, fds)
 
 
-def get_connection(bus):
+def get_address(bus):
     if bus == 'session':
-        addr = os.getenv(
+        return os.getenv(
             'DBUS_SESSION_BUS_ADDRESS',
             f'unix:path=/run/user/{os.getuid()}/bus',
         )
     else:  # pragma: no cover
-        addr = os.getenv(
+        return os.getenv(
             'DBUS_SYSTEM_BUS_ADDRESS',
             'unix:path=/run/dbus/system_bus_socket',
         )
-    return Connection(addr.removeprefix('unix:path=').split(',', 1)[0])
+
+
+def get_connection(bus):
+    return Connection(get_address(bus))
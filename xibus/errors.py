@@ -0,0 +1,136 @@
+# error name -> DBusError subclass
+ERRORS = {}
+# exception type -> error name (for exceptions raised in handlers)
+EXCEPTIONS = {}
+
+FAILED = 'org.freedesktop.DBus.Error.Failed'
+
+
+class DBusError(Exception):
+    # Subclasses that define a `name` are registered automatically. Errors
+    # received from a peer are raised as the registered subclass with the
+    # error name as first argument. `transient` errors might go away if the
+    # call is retried.
+    name = FAILED
+    transient = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'name' in cls.__dict__:
+            ERRORS[cls.name] = cls
+
+
+ERRORS[FAILED] = DBusError
+
+
+class CallTimeoutError(DBusError, TimeoutError):
+    name = 'org.freedesktop.DBus.Error.NoReply'
+    transient = True
+
+
+class DBusTimeoutError(DBusError, TimeoutError):
+    name = 'org.freedesktop.DBus.Error.Timeout'
+    transient = True
+
+
+class NoMemoryError(DBusError):
+    name = 'org.freedesktop.DBus.Error.NoMemory'
+    transient = True
+
+
+class LimitsExceededError(DBusError):
+    name = 'org.freedesktop.DBus.Error.LimitsExceeded'
+    transient = True
+
+
+class NoServerError(DBusError):
+    name = 'org.freedesktop.DBus.Error.NoServer'
+    transient = True
+
+
+class DisconnectedError(DBusError):
+    name = 'org.freedesktop.DBus.Error.Disconnected'
+    transient = True
+
+
+class ServiceUnknownError(DBusError):
+    name = 'org.freedesktop.DBus.Error.ServiceUnknown'
+
+
+class NameHasNoOwnerError(DBusError):
+    name = 'org.freedesktop.DBus.Error.NameHasNoOwner'
+
+
+class AccessDeniedError(DBusError, PermissionError):
+    name = 'org.freedesktop.DBus.Error.AccessDenied'
+
+
+class NotSupportedError(DBusError):
+    name = 'org.freedesktop.DBus.Error.NotSupported'
+
+
+class InvalidArgsError(DBusError, ValueError):
+    name = 'org.freedesktop.DBus.Error.InvalidArgs'
+
+
+class UnknownMethodError(DBusError):
+    name = 'org.freedesktop.DBus.Error.UnknownMethod'
+
+
+class UnknownObjectError(DBusError):
+    name = 'org.freedesktop.DBus.Error.UnknownObject'
+
+
+class UnknownInterfaceError(DBusError):
+    name = 'org.freedesktop.DBus.Error.UnknownInterface'
+
+
+class UnknownPropertyError(DBusError):
+    name = 'org.freedesktop.DBus.Error.UnknownProperty'
+
+
+class PropertyReadOnlyError(DBusError):
+    name = 'org.freedesktop.DBus.Error.PropertyReadOnly'
+
+
+ERRORS['org.freedesktop.DBus.Error.TimedOut'] = DBusTimeoutError
+
+
+def register_error(exc_type, name):
+    # map other exception types to error names, e.g. from libraries that
+    # are used in handlers
+    EXCEPTIONS[exc_type] = name
+
+
+register_error(TypeError, InvalidArgsError.name)
+register_error(ValueError, InvalidArgsError.name)
+register_error(NotImplementedError, NotSupportedError.name)
+register_error(PermissionError, AccessDeniedError.name)
+register_error(TimeoutError, DBusTimeoutError.name)
+register_error(MemoryError, NoMemoryError.name)
+
+
+def get_error_name(exc):
+    if isinstance(exc, DBusError):
+        return exc.name
+    for cls in type(exc).__mro__:
+        if cls in EXCEPTIONS:
+            return EXCEPTIONS[cls]
+    return FAILED
+
+
+def from_reply(name, body):
+    e = ERRORS.get(name, DBusError)(name)
+    # keep unknown names, e.g. when forwarding the error
+    e.name = name
+    if body and isinstance(body[0], str):
+        # same as add_note(), which is not available before python 3.11
+        e.__notes__ = [body[0]]
+    return e
+
+
+def is_transient(exc):
+    # whether it makes sense to retry the call
+    if isinstance(exc, DBusError):
+        return exc.transient
+    return isinstance(exc, (ConnectionError, TimeoutError))
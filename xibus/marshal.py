@@ -1,4 +1,7 @@
+import array
+import functools
 import struct
+import sys
 from dataclasses import dataclass
 
 TYPES = {
@@ -13,6 +16,8 @@ TYPES = {
     'd': 'd',  # float
 }
 
+NATIVE_ENDIAN = '<' if sys.byteorder == 'little' else '>'
+
 
 @dataclass
 class DictItem:
@@ -62,6 +67,20 @@ def parse_sig(sig):
         return values
 
 
+def unparse_sig(typ):
+    if isinstance(typ, tuple):
+        return '(' + ''.join(unparse_sig(t) for t in typ) + ')'
+    elif isinstance(typ, DictItem):
+        return '{' + unparse_sig(typ.key) + unparse_sig(typ.value) + '}'
+    elif isinstance(typ, List):
+        return 'a' + unparse_sig(typ.value)
+    return typ
+
+
+def split_sig(sig):
+    return [unparse_sig(typ) for typ in parse_sig(sig)]
+
+
 def get_align(typ):
     if isinstance(typ, List):
         return 4
@@ -76,6 +95,355 @@ def get_align(typ):
     raise ValueError(typ)
 
 
+class _Run:
+    # consecutive fixed-size values that can be handled in a single
+    # struct call
+    def __init__(self, align):
+        self.align = align
+        self.fmt = ''
+        self.count = 0
+
+
+def _layout(types, state):
+    # state is a tuple (align, phase) so that offset % align == phase
+    entries = []
+    for typ in types:
+        if isinstance(typ, str) and typ in TYPES:
+            align = get_align(typ)
+            if align > state[0]:
+                entries.append(_Run(align))
+                state = (align, 0)
+            elif not entries or not isinstance(entries[-1], _Run):
+                entries.append(_Run(1))
+            pad = -state[1] % align
+            entries[-1].fmt += 'x' * pad + TYPES[typ]
+            entries[-1].count += 1
+            state = (state[0], (state[1] + pad + align) % state[0])
+        elif isinstance(typ, (tuple, DictItem)):
+            entries.append(typ)
+            _, state = _layout(_members(typ), (8, 0))
+        elif typ == 'h':
+            entries.append(typ)
+            if state[0] < 4:
+                state = (4, 0)
+            else:
+                pad = -state[1] % 4
+                state = (state[0], (state[1] + pad + 4) % state[0])
+        else:
+            entries.append(typ)
+            state = (1, 0)
+    return entries, state
+
+
+def _members(typ):
+    if isinstance(typ, DictItem):
+        return [typ.key, typ.value]
+    return typ
+
+
+def _compile_read_seq(types, endian, state):
+    entries, _ = _layout(types, state)
+    steps = []
+    for entry in entries:
+        if isinstance(entry, _Run):
+            steps.append((_compile_read_run(entry, endian), True))
+        else:
+            steps.append((_compile_read(entry, endian), False))
+
+    if len(steps) == 1 and steps[0][1]:
+        return steps[0][0]
+
+    def read(buf, offset, fds):
+        values = []
+        for fn, is_run in steps:
+            value, offset = fn(buf, offset, fds)
+            if is_run:
+                values.extend(value)
+            else:
+                values.append(value)
+        return tuple(values), offset
+
+    return read
+
+
+def _compile_read_run(run, endian):
+    s = struct.Struct(endian + run.fmt)
+    align = run.align
+
+    def read(buf, offset, fds):
+        offset += -offset % align
+        return s.unpack_from(buf, offset), offset + s.size
+
+    return read
+
+
+def _fixed_struct(typ, endian):
+    # returns a struct.Struct if items of this type can be packed without
+    # any padding between them
+    if isinstance(typ, (tuple, DictItem)):
+        entries, _ = _layout(_members(typ), (8, 0))
+        if len(entries) == 1 and isinstance(entries[0], _Run):
+            s = struct.Struct(endian + entries[0].fmt)
+            if s.size % 8 == 0:
+                return s
+    return None
+
+
+def _compile_read_items(value_typ, endian):
+    if value_typ == 'y':
+        def read_items(buf, offset, end, fds):
+            return bytes(buf[offset:end])
+    elif isinstance(value_typ, str) and value_typ in TYPES:
+        code = TYPES[value_typ]
+        swap = endian != NATIVE_ENDIAN
+
+        def read_items(buf, offset, end, fds):
+            arr = array.array(code)
+            arr.frombytes(buf[offset:end])
+            if swap:
+                arr.byteswap()
+            return arr.tolist()
+    elif s := _fixed_struct(value_typ, endian):
+        def read_items(buf, offset, end, fds):
+            return list(s.iter_unpack(buf[offset:end]))
+    else:
+        read_item = _compile_read(value_typ, endian)
+
+        def read_items(buf, offset, end, fds):
+            arr = []
+            while offset < end:
+                value, offset = read_item(buf, offset, fds)
+                arr.append(value)
+            return arr
+    return read_items
+
+
+def _compile_read_list(value_typ, endian):
+    u32 = struct.Struct(f'{endian}I')
+    align = get_align(value_typ)
+    read_items = _compile_read_items(value_typ, endian)
+    is_dict = isinstance(value_typ, DictItem)
+
+    def read(buf, offset, fds):
+        offset += -offset % 4
+        (size,) = u32.unpack_from(buf, offset)
+        offset += 4
+        offset += -offset % align
+        end = offset + size
+        arr = read_items(buf, offset, end, fds)
+        if is_dict:
+            return dict(arr), end
+        return arr, end
+
+    return read
+
+
+def _compile_read(typ, endian):
+    if isinstance(typ, List):
+        return _compile_read_list(typ.value, endian)
+    elif isinstance(typ, (tuple, DictItem)):
+        read_members = _compile_read_seq(_members(typ), endian, (8, 0))
+
+        def read(buf, offset, fds):
+            return read_members(buf, offset + (-offset % 8), fds)
+    elif typ in TYPES:
+        s = struct.Struct(f'{endian}{TYPES[typ]}')
+        align = s.size
+
+        def read(buf, offset, fds):
+            offset += -offset % align
+            return s.unpack_from(buf, offset)[0], offset + align
+    elif typ in ['s', 'o', 'g']:
+        if typ == 'g':
+            s = struct.Struct('B')
+        else:
+            s = struct.Struct(f'{endian}I')
+        align = s.size
+
+        def read(buf, offset, fds):
+            offset += -offset % align
+            (size,) = s.unpack_from(buf, offset)
+            offset += align
+            return str(buf[offset:offset + size], 'utf-8'), offset + size + 1
+    elif typ == 'h':  # file descriptor
+        u32 = struct.Struct(f'{endian}I')
+
+        def read(buf, offset, fds):
+            offset += -offset % 4
+            (i,) = u32.unpack_from(buf, offset)
+            return fds[i], offset + 4
+    elif typ == 'v':
+        read_sig = _compile_read('g', endian)
+
+        def read(buf, offset, fds):
+            sig, offset = read_sig(buf, offset, fds)
+            v, offset = _compile_variant(sig, endian).read(buf, offset, fds)
+            return (sig, v), offset
+    else:
+        raise ValueError(typ)
+    return read
+
+
+def _compile_write_seq(types, endian, state):
+    entries, _ = _layout(types, state)
+    count = 0
+    steps = []
+    for entry in entries:
+        if isinstance(entry, _Run):
+            steps.append(_compile_write_run(entry, endian, count))
+            count += entry.count
+        else:
+            steps.append(_index(_compile_write(entry, endian), count))
+            count += 1
+
+    def write(w, values):
+        if len(values) != count:
+            raise ValueError(values)
+        for fn in steps:
+            fn(w, values)
+
+    return write
+
+
+def _index(fn, i):
+    def write(w, values):
+        fn(w, values[i])
+    return write
+
+
+def _compile_write_run(run, endian, start):
+    s = struct.Struct(endian + run.fmt)
+    align = run.align
+    end = start + run.count
+
+    def write(w, values):
+        w.write_padding(align)
+        w.buf += s.pack(*values[start:end])
+
+    return write
+
+
+def _compile_write_items(value_typ, endian):
+    if value_typ == 'y':
+        def write_items(w, value):
+            try:
+                w.buf += memoryview(value).cast('B')
+            except TypeError:
+                w.buf += bytes(value)
+    elif isinstance(value_typ, str) and value_typ in TYPES:
+        code = TYPES[value_typ]
+        swap = endian != NATIVE_ENDIAN
+
+        def write_items(w, value):
+            arr = array.array(code, value)
+            if swap:
+                arr.byteswap()
+            w.buf += arr
+    elif s := _fixed_struct(value_typ, endian):
+        def write_items(w, value):
+            for v in value:
+                w.buf += s.pack(*v)
+    else:
+        write_item = _compile_write(value_typ, endian)
+
+        def write_items(w, value):
+            for v in value:
+                write_item(w, v)
+    return write_items
+
+
+def _compile_write_list(value_typ, endian):
+    u32 = struct.Struct(f'{endian}I')
+    align = get_align(value_typ)
+    write_items = _compile_write_items(value_typ, endian)
+    is_dict = isinstance(value_typ, DictItem)
+
+    def write(w, value):
+        if is_dict:
+            value = value.items()
+        w.write_padding(4)
+        pos = len(w.buf)
+        w.buf += b'\0\0\0\0'  # size is filled in below
+        w.write_padding(align)
+        start = len(w.buf)
+        write_items(w, value)
+        u32.pack_into(w.buf, pos, len(w.buf) - start)
+
+    return write
+
+
+def _compile_write(typ, endian):
+    if isinstance(typ, List):
+        return _compile_write_list(typ.value, endian)
+    elif isinstance(typ, (tuple, DictItem)):
+        write_members = _compile_write_seq(_members(typ), endian, (8, 0))
+
+        def write(w, value):
+            w.write_padding(8)
+            write_members(w, value)
+    elif typ in TYPES:
+        s = struct.Struct(f'{endian}{TYPES[typ]}')
+        align = s.size
+
+        def write(w, value):
+            w.write_padding(align)
+            w.buf += s.pack(value)
+    elif typ in ['s', 'o', 'g']:
+        if typ == 'g':
+            s = struct.Struct('B')
+        else:
+            s = struct.Struct(f'{endian}I')
+        align = s.size
+
+        def write(w, value):
+            b = value.encode('utf-8')
+            w.write_padding(align)
+            w.buf += s.pack(len(b))
+            w.buf += b
+            w.buf.append(0)
+    elif typ == 'h':  # file descriptor
+        u32 = struct.Struct(f'{endian}I')
+
+        def write(w, value):
+            w.write_padding(4)
+            w.buf += u32.pack(len(w.fds))
+            w.fds.append(value if isinstance(value, int) else value.fileno())
+    elif typ == 'v':
+        write_sig = _compile_write('g', endian)
+
+        def write(w, value):
+            sig, v = value
+            codec = _compile_variant(sig, endian)
+            write_sig(w, sig)
+            codec.write(w, v)
+    else:
+        raise ValueError(typ)
+    return write
+
+
+class Codec:
+    def __init__(self, types, endian, phase):
+        self.read = _compile_read_seq(types, endian, (8, phase))
+        self.write = _compile_write_seq(types, endian, (8, phase))
+
+
+class _SingleCodec:
+    def __init__(self, typ, endian):
+        self.read = _compile_read(typ, endian)
+        self.write = _compile_write(typ, endian)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_sig(sig, endian, phase=0, count=None):
+    return Codec(parse_sig(sig)[:count], endian, phase)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_variant(sig, endian):
+    (typ,) = parse_sig(sig)
+    return _SingleCodec(typ, endian)
+
+
 class Reader:
     def __init__(self, buf, fds, endian):
         self.buf = buf
@@ -88,113 +456,23 @@ class Reader:
             align = get_align(align)
         self.offset += (align - self.offset) % align
 
-    def _read_str(self, typ):
-        if typ == 'g':
-            size = self.read('y')
-        else:
-            size = self.read('u')
-        (b,) = struct.unpack_from(f'{size}s', buffer=self.buf, offset=self.offset)
-        self.offset += size + 1
-        return b.decode('utf-8')
-
-    def _read_list(self, value_typ):
-        size = self.read('u')
-        self.skip_padding(value_typ)
-        end = self.offset + size
-        arr = []
-        while self.offset < end:
-            arr.append(self.read(value_typ))
-        if isinstance(value_typ, DictItem):
-            return dict(arr)
-        return arr
-
-    def read(self, typ):
-        self.skip_padding(typ)
-        if isinstance(typ, List):
-            return self._read_list(typ.value)
-        elif isinstance(typ, DictItem):
-            return self.read(typ.key), self.read(typ.value)
-        elif isinstance(typ, tuple):
-            return tuple([self.read(t) for t in typ])
-        elif typ in TYPES:
-            format = f'{self.endian}{TYPES[typ]}'
-            (value,) = struct.unpack_from(format, buffer=self.buf, offset=self.offset)
-            self.offset += struct.calcsize(format)
-            return value
-        elif typ in ['s', 'o', 'g']:
-            return self._read_str(typ)
-        elif typ == 'h':  # file descriptor
-            i = self.read('u')
-            return self.fds[i]
-        elif typ == 'v':
-            sig = self.read('g')
-            (t,) = parse_sig(sig)
-            v = self.read(t)
-            return (sig, v)
-        else:  # pragma: no cover
-            raise ValueError(typ)
-
-    def unmarshal(self, sig):
-        typ = parse_sig(sig)
-        return tuple([self.read(t) for t in typ])
+    def unmarshal(self, sig, count=None):
+        codec = compile_sig(sig, self.endian, self.offset % 8, count)
+        values, self.offset = codec.read(self.buf, self.offset, self.fds)
+        return values
 
 
 class Writer:
     def __init__(self, endian):
-        self.buf = b''
+        self.buf = bytearray()
         self.fds = []
         self.endian = endian
 
     def write_padding(self, align):
         if not isinstance(align, int):
             align = get_align(align)
-        self.buf += b'\0' * ((align - len(self.buf)) % align)
-
-    def _write_str(self, typ, value):
-        b = value.encode('utf-8')
-        if typ == 'g':
-            self.write('y', len(b))
-        else:
-            self.write('u', len(b))
-        self.buf += struct.pack(f'{self.endian}{len(b) + 1}s', b)
-
-    def _write_list(self, value_typ, value):
-        if isinstance(value_typ, DictItem):
-            value = value.items()
-        subwriter = Writer(self.endian)
-        for v in value:
-            subwriter.write(value_typ, v)
-        self.write('u', len(subwriter.buf))
-        self.write_padding(value_typ)
-        self.buf += subwriter.buf
-
-    def write(self, typ, value):
-        self.write_padding(typ)
-        if isinstance(typ, List):
-            self._write_list(typ.value, value)
-        elif isinstance(typ, DictItem):
-            k, v = value
-            self.write(typ.key, k)
-            self.write(typ.value, v)
-        elif isinstance(typ, tuple):
-            for t, v in zip(typ, value, strict=True):
-                self.write(t, v)
-        elif typ in TYPES:
-            self.buf += struct.pack(f'{self.endian}{TYPES[typ]}', value)
-        elif typ in ['s', 'o', 'g']:
-            self._write_str(typ, value)
-        elif typ == 'h':  # file descriptor
-            self.write('u', len(self.fds))
-            self.fds.append(value if isinstance(value, int) else value.fileno())
-        elif typ == 'v':
-            sig, v = value
-            (t,) = parse_sig(sig)
-            self.write('g', sig)
-            self.write(t, v)
-        else:  # pragma: no cover
-            raise ValueError(typ)
+        self.buf += bytes((align - len(self.buf)) % align)
 
     def marshal(self, sig, data):
-        typ = parse_sig(sig)
-        for t, value in zip(typ, data, strict=True):
-            self.write(t, value)
+        codec = compile_sig(sig, self.endian, len(self.buf) % 8)
+        codec.write(self, data)
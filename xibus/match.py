@@ -0,0 +1,139 @@
+import collections
+from dataclasses import dataclass
+
+from .message import MsgType
+
+
+def quote(value):
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+def in_namespace(value, namespace, sep):
+    return (
+        value == namespace
+        or value.startswith(namespace.rstrip(sep) + sep)
+    )
+
+
+def match_path(value, pattern):
+    return (
+        value == pattern
+        or (pattern.endswith('/') and value.startswith(pattern))
+        or (value.endswith('/') and pattern.startswith(value))
+    )
+
+
+@dataclass(frozen=True)
+class MatchRule:
+    type: MsgType = None
+    sender: str = None
+    path: str = None
+    path_namespace: str = None
+    iface: str = None
+    member: str = None
+    destination: str = None
+    args: tuple = ()  # (index, value) pairs
+    arg_paths: tuple = ()  # (index, value) pairs
+    arg0namespace: str = None
+
+    def __str__(self):
+        items = [
+            ('type', self.type and self.type.name.lower()),
+            ('sender', self.sender),
+            ('path', self.path),
+            ('path_namespace', self.path_namespace),
+            ('interface', self.iface),
+            ('member', self.member),
+            ('destination', self.destination),
+            *((f'arg{i}', value) for i, value in self.args),
+            *((f'arg{i}path', value) for i, value in self.arg_paths),
+            ('arg0namespace', self.arg0namespace),
+        ]
+        return ','.join(
+            f'{key}={quote(value)}' for key, value in items if value is not None
+        )
+
+    @property
+    def key(self):
+        return (self.sender, self.path, self.iface, self.member)
+
+    def _match_args(self, msg):
+        indices = [i for i, _ in self.args + self.arg_paths]
+        if self.arg0namespace is not None:
+            indices.append(0)
+        body = msg.get_body(max(indices) + 1)
+
+        def get_str(i):
+            if i < len(body) and isinstance(body[i], str):
+                return body[i]
+            return None
+
+        return (
+            all(get_str(i) == value for i, value in self.args)
+            and all(
+                get_str(i) is not None and match_path(get_str(i), value)
+                for i, value in self.arg_paths
+            )
+            and (
+                self.arg0namespace is None
+                or (
+                    get_str(0) is not None
+                    and in_namespace(get_str(0), self.arg0namespace, '.')
+                )
+            )
+        )
+
+    def matches(self, msg):
+        for value, expected in [
+            (msg.type, self.type),
+            (msg.sender, self.sender),
+            (msg.path, self.path),
+            (msg.iface, self.iface),
+            (msg.member, self.member),
+            (msg.destination, self.destination),
+        ]:
+            if expected is not None and value != expected:
+                return False
+        if self.path_namespace is not None and (
+            msg.path is None or not in_namespace(msg.path, self.path_namespace, '/')
+        ):
+            return False
+        if self.args or self.arg_paths or self.arg0namespace is not None:
+            return self._match_args(msg)
+        return True
+
+
+class MatchTable:
+    # rules are indexed by (sender, path, iface, member) where each part
+    # can be a wildcard. On lookup, only the combinations of wildcards
+    # that are actually in use are checked.
+
+    def __init__(self):
+        self.index = {}
+        self.masks = collections.Counter()
+
+    def add(self, rule, queue):
+        rules = self.index.setdefault(rule.key, {})
+        rules.setdefault(rule, set()).add(queue)
+        self.masks[tuple(v is not None for v in rule.key)] += 1
+
+    def remove(self, rule, queue):
+        rules = self.index[rule.key]
+        rules[rule].remove(queue)
+        if not rules[rule]:
+            del rules[rule]
+        if not rules:
+            del self.index[rule.key]
+
+        mask = tuple(v is not None for v in rule.key)
+        self.masks[mask] -= 1
+        if not self.masks[mask]:
+            del self.masks[mask]
+
+    def lookup(self, msg):
+        msg_key = (msg.sender, msg.path, msg.iface, msg.member)
+        for mask in self.masks:
+            key = tuple(v if m else None for v, m in zip(msg_key, mask))
+            for rule, queues in self.index.get(key, {}).items():
+                if rule.matches(msg):
+                    yield from queues
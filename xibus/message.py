@@ -1,10 +1,13 @@
 import enum
+import struct
 from dataclasses import dataclass
 
 from .marshal import Reader
 from .marshal import Writer
 
 VERSION = 1
+MAX_SIZE = 134217728
+HEADER_SIZE = 16
 
 ENDIAN = {
     '<': 108,
@@ -16,6 +19,20 @@ ENDIAN_REV = {
 }
 
 
+def get_msg_size(buf):
+    # returns None if buf does not contain enough data to tell
+    if len(buf) < HEADER_SIZE:
+        return None
+    endian = ENDIAN_REV[buf[0]]
+    body_size, _serial, headers_size = struct.unpack_from(
+        f'{endian}III', buf, offset=4
+    )
+    size = HEADER_SIZE + headers_size + (-headers_size % 8) + body_size
+    if size > MAX_SIZE:
+        raise ValueError(size)
+    return size
+
+
 class MsgHeader(enum.IntEnum):
     PATH = 1
     IFACE = 2
@@ -50,6 +67,33 @@ class MsgFlag(enum.Flag):
     ALLOW_INTERACTIVE_AUTHORIZATION = 0x4
 
 
+class RawBody:
+    def __init__(self, buf, fds, endian, sig):
+        self.buf = buf
+        self.fds = fds
+        self.endian = endian
+        self.sig = sig
+
+    def decode(self, count=None):
+        r = Reader(self.buf, self.fds, self.endian)
+        return r.unmarshal(self.sig, count)
+
+
+class LazyBody:
+    # data descriptor that decodes a RawBody on first access
+    def __get__(self, msg, owner=None):
+        if msg is None:
+            return ()
+        body = msg.__dict__['body']
+        if isinstance(body, RawBody):
+            body = body.decode()
+            msg.__dict__['body'] = body
+        return body
+
+    def __set__(self, msg, value):
+        msg.__dict__['body'] = value
+
+
 @dataclass
 class Msg:
     type: MsgType
@@ -63,7 +107,14 @@ class Msg:
     member: str = None
     error_name: str = None
     sig: str = ''
-    body: str = ()
+    body: str = LazyBody()
+
+    def get_body(self, count=None):
+        # decode only the first `count` arguments
+        body = self.__dict__['body']
+        if isinstance(body, RawBody) and count is not None:
+            return body.decode(count)
+        return self.body[:count]
 
     def marshal(self, endian='<'):
         w_body = Writer(endian)
@@ -95,15 +146,16 @@ class Msg:
             headers,
         ])
         w.write_padding(8)
+        w.buf += w_body.buf
 
-        return w.buf + w_body.buf, w_body.fds
+        return memoryview(w.buf), w_body.fds
 
     @classmethod
-    def unmarshal(cls, buf, fds):
+    def unmarshal(cls, buf, fds, lazy=False):
         r = Reader(buf, fds, ENDIAN_REV[buf[0]])
         r.offset += 1
 
-        type, flags, version, _size, serial, headers = r.unmarshal('yyyuua{yv}')
+        type, flags, version, size, serial, headers = r.unmarshal('yyyuua{yv}')
         if version != VERSION:
             raise ValueError(version)
 
@@ -115,11 +167,17 @@ class Msg:
                 if value[0] != header.get_sig():
                     raise ValueError(header, value)
                 if header is MsgHeader.UNIX_FDS:
-                    fds = fds[value[1]:]
+                    fds, r.fds = fds[value[1]:], fds[:value[1]]
                 else:
                     setattr(msg, header.name.lower(), value[1])
 
         r.skip_padding(8)
-        msg.body = r.unmarshal(msg.sig)
-
-        return msg, r.buf[r.offset:], fds
+        end = r.offset + size
+        if lazy:
+            # copy because buf might be reused
+            body_buf = bytes(r.buf[r.offset:end])
+            msg.body = RawBody(body_buf, r.fds, r.endian, msg.sig)
+        else:
+            msg.body = r.unmarshal(msg.sig)
+
+        return msg, r.buf[end:], fds
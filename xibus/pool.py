@@ -0,0 +1,111 @@
+import asyncio
+import contextlib
+import contextvars
+
+from .connection import Connection
+
+_pinned = contextvars.ContextVar('xibus_pinned', default=False)
+
+
+@contextlib.contextmanager
+def pinned():
+    # Calls in this context use the first connection of a ConnectionGroup.
+    # This is required if the meaning of a call depends on the unique name
+    # of the caller.
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class ConnectionGroup:
+    # Behaves like the first connection, but independent method calls are
+    # spread over all connections. Calls to the bus daemon (e.g. AddMatch
+    # or RequestName) always use the first connection because they affect
+    # its state.
+
+    def __init__(self, cons):
+        self.cons = cons
+
+    def __getattr__(self, name):
+        return getattr(self.cons[0], name)
+
+    def _pick(self, dest):
+        if dest == 'org.freedesktop.DBus' or _pinned.get():
+            return self.cons[0]
+        return min(self.cons, key=lambda con: len(con.replies))
+
+    async def call(self, dest, *args, **kwargs):
+        return await self._pick(dest).call(dest, *args, **kwargs)
+
+    async def call_many(self, calls, **kwargs):
+        calls = list(calls)
+        con = self._pick(calls[0][0] if calls else None)
+        if _pinned.get() or any(call[0] == 'org.freedesktop.DBus' for call in calls):
+            con = self.cons[0]
+        async for i, result in con.call_many(calls, **kwargs):
+            yield i, result
+
+
+class ConnectionPool:
+    # Keeps authenticated connections open so they can be reused across
+    # get_client() contexts. With size > 1, calls are spread over several
+    # connections.
+
+    def __init__(self, size=1, *, reconnect=False):
+        self.size = size
+        self.reconnect = reconnect
+        self.groups = {}
+        self.stack = contextlib.AsyncExitStack()
+
+    async def _open(self, addr):
+        cons = [Connection(addr, reconnect=self.reconnect) for _ in range(self.size)]
+        async with contextlib.AsyncExitStack() as stack:
+            results = await asyncio.gather(
+                *[stack.enter_async_context(con) for con in cons],
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            self.stack.push_async_exit(stack.pop_all())
+        return ConnectionGroup(cons)
+
+    def _is_alive(self, task):
+        if not task.done():
+            return True
+        return (
+            not task.cancelled()
+            and not task.exception()
+            and all(
+                con.sock is not None or con.reconnect_task
+                for con in task.result().cons
+            )
+        )
+
+    @contextlib.asynccontextmanager
+    async def connection(self, addr):
+        task = self.groups.get(addr)
+        if task is None or not self._is_alive(task):
+            task = self.groups[addr] = asyncio.ensure_future(self._open(addr))
+        try:
+            group = await asyncio.shield(task)
+            # wait for connections that are currently reconnecting
+            for con in group.cons:
+                await con.connected.wait()
+            yield group
+        except BaseException:
+            if self.groups.get(addr) is task and not self._is_alive(task):
+                del self.groups[addr]
+            raise
+
+    async def close(self):
+        self.groups = {}
+        await self.stack.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await self.close()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import socket
+import struct
+import uuid
+
+from .address import get_listen_addr
+from .connection import Connection
+
+MAX_AUTH_SIZE = 16384
+
+
+class AuthError(ConnectionError):
+    pass
+
+
+def get_peer_uid(sock):
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')
+    )
+    _pid, uid, _gid = struct.unpack('3i', creds)
+    return uid
+
+
+class Server:
+    # Listens for peer-to-peer connections (without a bus daemon). `addr` is
+    # either a socket path (a leading null byte for abstract sockets) or a
+    # unix: address. The address clients should use is available as
+    # `address`.
+
+    def __init__(self, addr, loop=None, *, uids=None, timeout=10):
+        self.addr, self.address = get_listen_addr(addr)
+        self.loop = loop
+        self.uids = uids or {os.getuid()}
+        self.timeout = timeout
+        self.guid = uuid.uuid4().hex
+        self.queue = asyncio.Queue()
+        self.handshakes = set()
+        self.sock = None
+        self.task = None
+
+        if not self.loop:
+            self.loop = asyncio.get_running_loop()
+
+    def _check_uid(self, sock, initial):
+        uid = get_peer_uid(sock)
+        try:
+            if initial and int(bytes.fromhex(initial.decode()).decode()) != uid:
+                return False
+        except ValueError:
+            return False
+        return uid in self.uids
+
+    async def _auth(self, con):
+        # server side of SASL EXTERNAL; returns any data that was received
+        # after BEGIN
+        buf = b''
+        authenticated = False
+
+        async def readline():
+            nonlocal buf
+            while b'\r\n' not in buf:
+                if len(buf) > MAX_AUTH_SIZE:
+                    raise AuthError('Auth line too long')
+                data = await self.loop.sock_recv(con.sock, 4096)
+                if not data:
+                    raise AuthError('Connection closed during auth')
+                buf += data
+            line, buf = buf.split(b'\r\n', 1)
+            return line
+
+        while not buf:
+            buf = await self.loop.sock_recv(con.sock, 4096)
+            if not buf:
+                raise AuthError('Connection closed during auth')
+        if buf[:1] != b'\0':
+            raise AuthError('Missing credentials byte')
+        buf = buf[1:]
+
+        while True:
+            cmd, _, arg = (await readline()).partition(b' ')
+            if cmd == b'AUTH':
+                mech, _, initial = arg.partition(b' ')
+                if mech != b'EXTERNAL':
+                    await con.send(b'REJECTED EXTERNAL\r\n')
+                    continue
+                if not initial:
+                    await con.send(b'DATA\r\n')
+                    cmd, _, initial = (await readline()).partition(b' ')
+                if cmd in [b'AUTH', b'DATA'] and self._check_uid(con.sock, initial):
+                    await con.send(f'OK {self.guid}\r\n'.encode('ascii'))
+                    authenticated = True
+                else:
+                    await con.send(b'REJECTED EXTERNAL\r\n')
+            elif cmd == b'NEGOTIATE_UNIX_FD' and authenticated:
+                await con.send(b'AGREE_UNIX_FD\r\n')
+            elif cmd == b'BEGIN' and authenticated:
+                return buf
+            elif cmd in [b'CANCEL', b'ERROR']:
+                authenticated = False
+                await con.send(b'REJECTED EXTERNAL\r\n')
+            else:
+                await con.send(b'ERROR\r\n')
+
+    async def _handshake(self, sock):
+        con = Connection(None, self.loop, bus=False)
+        con.sock = sock
+        try:
+            rest = await asyncio.wait_for(self._auth(con), self.timeout)
+        except (OSError, asyncio.TimeoutError):  # noqa: UP041
+            sock.close()
+            return
+        except asyncio.CancelledError:
+            sock.close()
+            raise
+        if len(rest) > len(con.recv_buf):
+            con.recv_buf.extend(bytes(len(rest) - len(con.recv_buf)))
+        con.recv_buf[:len(rest)] = rest
+        con.recv_len = len(rest)
+        self.queue.put_nowait(con)
+
+    async def _accept_loop(self):
+        while True:
+            sock, _ = await self.loop.sock_accept(self.sock)
+            sock.setblocking(False)
+            # authenticate concurrently so a slow client cannot block others
+            task = asyncio.create_task(self._handshake(sock))
+            self.handshakes.add(task)
+            task.add_done_callback(self.handshakes.discard)
+
+    async def accept(self):
+        return await self.queue.get()
+
+    async def __aiter__(self):
+        while True:
+            yield await self.accept()
+
+    async def __aenter__(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.bind(self.addr)
+        self.sock.listen()
+        self.task = asyncio.create_task(self._accept_loop())
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        for task in [self.task, *self.handshakes]:
+            task.cancel()
+        await asyncio.gather(self.task, *self.handshakes, return_exceptions=True)
+        while not self.queue.empty():
+            self.queue.get_nowait().sock.close()
+        self.sock.close()
+        self.sock = None
+        if not self.addr.startswith('\0'):
+            os.unlink(self.addr)
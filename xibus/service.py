@@ -0,0 +1,445 @@
+import asyncio
+import collections
+import contextlib
+import inspect
+
+from .connection import RE_PATH
+from .connection import InvalidPathError
+from .errors import InvalidArgsError
+from .errors import PropertyReadOnlyError
+from .errors import UnknownMethodError
+from .errors import UnknownObjectError
+from .errors import UnknownPropertyError
+from .marshal import compile_sig
+from .marshal import parse_sig
+from .marshal import split_sig
+from .schema import Schema
+
+
+class FairQueue:
+    # calls are served round-robin between senders so that a single busy
+    # client cannot starve the others
+
+    def __init__(self, maxsize=32):
+        self.queues = {}
+        self.senders = collections.deque()
+        self.event = asyncio.Event()
+        self.space = asyncio.Semaphore(maxsize)
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def put(self, call):
+        await self.space.acquire()
+        if call.sender not in self.queues:
+            self.queues[call.sender] = collections.deque()
+            self.senders.append(call.sender)
+        self.queues[call.sender].append(call)
+        self.event.set()
+
+    async def get(self):
+        while not self.senders:
+            self.event.clear()
+            await self.event.wait()
+        sender = self.senders.popleft()
+        queue = self.queues[sender]
+        call = queue.popleft()
+        if queue:
+            self.senders.append(sender)
+        else:
+            del self.queues[sender]
+        self.space.release()
+        return call
+
+
+class Method:
+    def __init__(self, func, sig='', *, offload=False, executor=None):
+        self.func = func
+        self.sig = sig
+        self.count = len(parse_sig(sig))
+        self.offload = offload
+        self.executor = executor
+
+        # compile the reply signature ahead of time
+        compile_sig(sig, '<')
+
+    async def __call__(self, call):
+        if self.offload:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, self.func, *call.body)
+        else:
+            result = self.func(*call.body)
+            if inspect.isawaitable(result):
+                result = await result
+
+        if self.count == 0:
+            return self.sig, ()
+        elif self.count == 1:
+            return self.sig, (result,)
+        else:
+            return self.sig, result
+
+
+def method(iface, args='', returns='', *, name=None, offload=False):
+    def decorator(func):
+        func.dbus_method = (iface, name or func.__name__, args, returns, offload)
+        return func
+    return decorator
+
+
+def _exports(obj):
+    return obj.__dict__.setdefault('_xibus_exports', set())
+
+
+class prop:
+    def __init__(self, iface, sig, *, name=None, access='read', default=None):
+        self.iface = iface
+        self.sig = sig
+        self.name = name
+        self.access = access
+        self.default = default
+
+    def __set_name__(self, owner, attr):
+        self.attr = attr
+        self.name = self.name or attr
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        return obj.__dict__.get(self.attr, self.default)
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.attr] = value
+        for service, path in _exports(obj):
+            service.property_changed(path, self.iface, self.name, self.sig, value)
+
+
+class signal:
+    def __init__(self, iface, args='', *, name=None):
+        self.iface = iface
+        self.args = args
+        self.name = name
+
+    def __call__(self, func):
+        self.func = func
+        self.name = self.name or func.__name__
+        return self
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+
+        def emit(*args, **kwargs):
+            body = self.func(obj, *args, **kwargs)
+            count = len(parse_sig(self.args))
+            if count == 0:
+                body = ()
+            elif count == 1:
+                body = (body,)
+            for service, path in _exports(obj):
+                service.emit_signal(path, self.iface, self.name, body, self.args)
+
+        return emit
+
+
+class Exported:
+    def __init__(self, obj):
+        self.obj = obj
+        self.methods = {}
+        self.properties = {}
+        self.schema = Schema()
+
+        for attr in dir(type(obj)):
+            value = getattr(type(obj), attr)
+            if isinstance(value, prop):
+                self.properties[value.iface, value.name] = value
+                self.schema.add_property(
+                    value.iface, value.name, value.sig, value.access
+                )
+            elif isinstance(value, signal):
+                self.schema.add_signal(value.iface, value.name, split_sig(value.args))
+            elif hasattr(value, 'dbus_method'):
+                iface, name, args, returns, offload = value.dbus_method
+                self.methods[iface, name] = (getattr(obj, attr), returns, offload)
+                self.schema.add_method(iface, name, split_sig(args), split_sig(returns))
+
+    def get_all(self, iface):
+        return {
+            p.name: (p.sig, p.__get__(self.obj))
+            for (i, _), p in self.properties.items()
+            if i == iface and p.access != 'write'
+        }
+
+
+class PropertiesEmitter:
+    # Property changes are merged per (path, iface) and sent as a single
+    # PropertiesChanged signal, either at the end of the current loop
+    # iteration or after `interval` seconds. Only the latest value of each
+    # property is sent.
+
+    def __init__(self, con, interval=None):
+        self.con = con
+        self.interval = interval
+        self.pending = {}
+        self.handle = None
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def _schedule(self):
+        if self.handle is None:
+            loop = asyncio.get_running_loop()
+            if self.interval is None:
+                self.handle = loop.call_soon(self.flush)
+            else:
+                self.handle = loop.call_later(self.interval, self.flush)
+
+    def _get_entry(self, path, iface):
+        self._schedule()
+        return self.pending.setdefault((path, iface), ({}, {}))
+
+    def changed(self, path, iface, name, sig, value):
+        changed, invalidated = self._get_entry(path, iface)
+        if name in changed or name in invalidated:
+            self.coalesced += 1
+        invalidated.pop(name, None)
+        changed[name] = (sig, value)
+
+    def invalidated(self, path, iface, name):
+        changed, invalidated = self._get_entry(path, iface)
+        if name in changed or name in invalidated:
+            self.coalesced += 1
+        changed.pop(name, None)
+        invalidated[name] = None
+
+    def flush(self):
+        # send pending changes now, e.g. before a signal that depends on them
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        pending, self.pending = self.pending, {}
+        for (path, iface), (changed, invalidated) in pending.items():
+            # one broken entry must not affect the others
+            try:
+                self.con.emit_signal_nowait(
+                    path,
+                    'org.freedesktop.DBus.Properties',
+                    'PropertiesChanged',
+                    (iface, changed, list(invalidated)),
+                    'sa{sv}as',
+                )
+            except Exception as e:  # noqa: BLE001
+                self.failed += 1
+                self.con.loop.call_exception_handler({
+                    'message': f'Failed to send PropertiesChanged for {path}',
+                    'exception': e,
+                })
+            else:
+                self.sent += 1
+
+
+class Service:
+    def __init__(
+        self,
+        con,
+        *,
+        limit=16,
+        backlog=1024,
+        executor=None,
+        object_manager=None,
+        interval=None,
+    ):
+        self.con = con
+        self.limit = limit
+        self.backlog = backlog
+        self.executor = executor
+        self.methods = {}
+        self.objects = {}
+        self.xml_cache = {}
+        self.object_manager = object_manager
+        self.emitter = PropertiesEmitter(con, interval)
+
+        for iface, member, handler in [
+            ('org.freedesktop.DBus.Introspectable', 'Introspect', self._introspect),
+            ('org.freedesktop.DBus.Properties', 'Get', self._get_property),
+            ('org.freedesktop.DBus.Properties', 'GetAll', self._get_all),
+            ('org.freedesktop.DBus.Properties', 'Set', self._set_property),
+            (
+                'org.freedesktop.DBus.ObjectManager',
+                'GetManagedObjects',
+                self._get_managed_objects,
+            ),
+        ]:
+            self.methods[None, iface, member] = handler
+
+    def add_method(self, iface, member, func, sig='', *, path=None, offload=False):
+        # path=None registers the method on all paths
+        method = Method(func, sig, offload=offload, executor=self.executor)
+        self.methods[path, iface, member] = method
+        # the interface is optional in method calls
+        self.methods.setdefault((path, None, member), method)
+
+    def method(self, iface, member=None, sig='', **kwargs):
+        def decorator(func):
+            self.add_method(iface, member or func.__name__, func, sig, **kwargs)
+            return func
+        return decorator
+
+    def get_handler(self, call):
+        for path in [call.path, None]:
+            method = self.methods.get((path, call.iface, call.member))
+            if method:
+                return method
+        return self._unknown_method
+
+    def emit_signal(self, path, iface, member, body, sig):
+        # signals must not overtake pending property changes
+        self.emitter.flush()
+        self.con.emit_signal_nowait(path, iface, member, body, sig)
+
+    def property_changed(self, path, iface, name, sig, value):
+        self.emitter.changed(path, iface, name, sig, value)
+
+    def _is_managed(self, path):
+        return (
+            self.object_manager is not None
+            and path != self.object_manager
+            and path.startswith(self.object_manager.rstrip('/') + '/')
+        )
+
+    def export(self, path, obj):
+        if not RE_PATH.match(path):
+            raise InvalidPathError(path)
+        if path in self.objects:
+            raise ValueError(path)
+        exported = Exported(obj)
+        self.objects[path] = exported
+        for (iface, member), (func, returns, offload) in exported.methods.items():
+            self.add_method(iface, member, func, returns, path=path, offload=offload)
+        _exports(obj).add((self, path))
+        self.xml_cache.clear()
+
+        if self._is_managed(path):
+            self.emit_signal(
+                self.object_manager,
+                'org.freedesktop.DBus.ObjectManager',
+                'InterfacesAdded',
+                (path, {
+                    iface: exported.get_all(iface)
+                    for iface in exported.schema.interfaces
+                }),
+                'oa{sa{sv}}',
+            )
+
+    def unexport(self, path):
+        exported = self.objects.pop(path)
+        for key in [key for key in self.methods if key[0] == path]:
+            del self.methods[key]
+        _exports(exported.obj).discard((self, path))
+        self.xml_cache.clear()
+
+        if self._is_managed(path):
+            self.emit_signal(
+                self.object_manager,
+                'org.freedesktop.DBus.ObjectManager',
+                'InterfacesRemoved',
+                (path, list(exported.schema.interfaces)),
+                'oas',
+            )
+
+    def _get_object(self, path):
+        if path not in self.objects:
+            raise UnknownObjectError(f'Unknown object {path}')
+        return self.objects[path]
+
+    def get_xml(self, path):
+        if path not in self.xml_cache:
+            schema = Schema()
+            if path in self.objects:
+                schema.interfaces.update(self.objects[path].schema.interfaces)
+                schema.add_defaults()
+            if path == self.object_manager:
+                schema.add_method(
+                    'org.freedesktop.DBus.ObjectManager',
+                    'GetManagedObjects',
+                    [],
+                    ['a{oa{sa{sv}}}'],
+                )
+            prefix = path.rstrip('/') + '/'
+            schema.nodes = list(dict.fromkeys(
+                p[len(prefix):].split('/')[0]
+                for p in [*self.objects, self.object_manager]
+                if p and p != path and p.startswith(prefix)
+            ))
+            self.xml_cache[path] = schema.to_xml()
+        return self.xml_cache[path]
+
+    async def _introspect(self, call):
+        return 's', (self.get_xml(call.path),)
+
+    async def _get_property(self, call):
+        iface, name = call.body
+        p = self._get_object(call.path).properties.get((iface, name))
+        if p is None or p.access == 'write':
+            raise UnknownPropertyError(f'Unknown property {iface}.{name}')
+        return 'v', ((p.sig, p.__get__(self.objects[call.path].obj)),)
+
+    async def _get_all(self, call):
+        (iface,) = call.body
+        return 'a{sv}', (self._get_object(call.path).get_all(iface),)
+
+    async def _set_property(self, call):
+        iface, name, (sig, value) = call.body
+        exported = self._get_object(call.path)
+        p = exported.properties.get((iface, name))
+        if p is None:
+            raise UnknownPropertyError(f'Unknown property {iface}.{name}')
+        elif p.access == 'read':
+            raise PropertyReadOnlyError(f'Property {iface}.{name} is read-only')
+        elif sig != p.sig:
+            raise InvalidArgsError(f'Property {iface}.{name} has type {p.sig}')
+        p.__set__(exported.obj, value)
+        return '', ()
+
+    async def _get_managed_objects(self, call):
+        if call.path != self.object_manager:
+            raise UnknownMethodError(self._unknown_message(call))
+        return 'a{oa{sa{sv}}}', ({
+            path: {
+                iface: exported.get_all(iface)
+                for iface in exported.schema.interfaces
+            }
+            for path, exported in self.objects.items()
+            if self._is_managed(path)
+        },)
+
+    def _unknown_message(self, call):
+        member = f'{call.iface}.{call.member}' if call.iface else call.member
+        return f'Unknown method {member} on {call.path}'
+
+    async def _unknown_method(self, call):
+        raise UnknownMethodError(self._unknown_message(call))
+
+    async def _work(self, queue):
+        while True:
+            call = await queue.get()
+            # e.g. the connection was lost while the handler was running
+            with contextlib.suppress(OSError):
+                await self.con.send_reply(call, self.get_handler(call))
+
+    async def serve(self, queue):
+        # Dispatch calls from a call_queue() with up to `limit` concurrent
+        # handlers. Calls are moved to the FairQueue as soon as they arrive,
+        # so all waiting callers take turns. Reading from the connection is
+        # paused while `backlog` calls are waiting.
+        fair = FairQueue(self.backlog)
+        workers = [
+            asyncio.create_task(self._work(fair)) for _ in range(self.limit)
+        ]
+        try:
+            async for call in queue:
+                await fair.put(call)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
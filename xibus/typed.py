@@ -0,0 +1,227 @@
+import keyword
+import re
+import weakref
+
+from .errors import PropertyReadOnlyError
+from .marshal import compile_sig
+
+IPROP = 'org.freedesktop.DBus.Properties'
+RE_MEMBER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+RE_IFACE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)+$')
+
+_classes = weakref.WeakKeyDictionary()
+
+
+class ProxyProperty:
+    # `await proxy.Prop` gets the value, see TypedProxy.set_property()
+    def __init__(self, name, sig, access):
+        self.name = name
+        self.sig = sig
+        self.access = access
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        return obj._get_property(self.name)
+
+
+class ProxySignal:
+    # `async for args in proxy.Signal` subscribes until the loop is left
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        return obj._subscribe(self.name)
+
+
+class TypedProxy:
+    # Base class for generated proxies. Methods call the connection
+    # directly, so there is no introspection or signature lookup per call.
+
+    iface = None
+    _signatures = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # fail when the class is created rather than on the first call
+        for sig in cls._signatures:
+            compile_sig(sig, '<')
+
+    def __init__(self, client, name, path):
+        self._client = client
+        self._name = name
+        self._path = path
+
+    async def _call(self, member, body, sig, timeout):
+        return await self._client.con.call(
+            self._name, self._path, self.iface, member, body, sig, timeout=timeout
+        )
+
+    async def _get_property(self, prop):
+        cache = self._client.property_caches.get((self._name, self._path, self.iface))
+        if cache and prop in cache.values:
+            return cache.values[prop]
+        ((_sig, value),) = await self._client.con.call(
+            self._name, self._path, IPROP, 'Get', (self.iface, prop), 'ss'
+        )
+        return value
+
+    async def set_property(self, prop, value, *, timeout=None):
+        p = getattr(type(self), prop)
+        if p.access == 'read':
+            raise PropertyReadOnlyError(f'Property {self.iface}.{prop} is read-only')
+        await self._client.con.call(
+            self._name,
+            self._path,
+            IPROP,
+            'Set',
+            (self.iface, prop, (p.sig, value)),
+            'ssv',
+            timeout=timeout,
+        )
+
+    async def _subscribe(self, member):
+        async with self._client.subscribe_signal(
+            self._name, self._path, self.iface, member
+        ) as queue:
+            async for args in queue:
+                yield args
+
+
+def _check(regex, name):
+    # names come from the peer, so they must not be trusted
+    if not isinstance(name, str) or not regex.match(name):
+        raise ValueError(f'Invalid name: {name!r}')
+    return name
+
+
+def _identifier(name):
+    # members must not replace attributes of TypedProxy
+    _check(RE_MEMBER, name)
+    if keyword.iskeyword(name) or hasattr(TypedProxy, name):
+        return name + '_'
+    return name
+
+
+def _class_name(iface):
+    _check(RE_IFACE, iface)
+    return ''.join(part[:1].upper() + part[1:] for part in re.split(r'[._]', iface))
+
+
+def _get_signatures(definition):
+    return tuple(sorted({
+        *(''.join(typ for _, typ in m.args) for m in definition.methods.values()),
+        *(''.join(typ for _, typ in m.returns) for m in definition.methods.values()),
+        *(''.join(typ for _, typ in s.args) for s in definition.signals.values()),
+        *(p.type for p in definition.properties.values()),
+    }))
+
+
+def _arg_names(args):
+    names = []
+    for i, (name, _) in enumerate(args):
+        if (
+            not name
+            or not name.isidentifier()
+            or keyword.iskeyword(name)
+            or name in ['self', 'timeout', *names]
+        ):
+            name = f'arg{i}'
+        names.append(name)
+    return names
+
+
+def _method_source(member, method):
+    names = _arg_names(method.args)
+    sig = ''.join(typ for _, typ in method.args)
+    params = ''.join(f'{name}, ' for name in names)
+    body = ', '.join(names) + (',' if len(names) == 1 else '')
+    call = f'await self._call({member!r}, ({body}), {sig!r}, timeout)'
+    if len(method.returns) == 0:
+        result = f'        {call}\n'
+    elif len(method.returns) == 1:
+        result = f'        (result,) = {call}\n        return result\n'
+    else:
+        result = f'        return {call}\n'
+    return (
+        f'    async def {_identifier(member)}(self, {params}*, timeout=None):\n'
+        + result
+    )
+
+
+def _class_source(iface, definition):
+    lines = [
+        f'class {_class_name(iface)}(TypedProxy):\n',
+        f'    iface = {iface!r}\n',
+        f'    _signatures = {_get_signatures(definition)!r}\n',
+    ]
+    for member, method in definition.methods.items():
+        lines.append('\n')
+        lines.append(_method_source(member, method))
+    if definition.properties or definition.signals:
+        lines.append('\n')
+    for name, p in definition.properties.items():
+        lines.append(
+            f'    {_identifier(name)} = ProxyProperty({name!r}, {p.type!r}, '
+            f'{p.access!r})\n'
+        )
+    for name in definition.signals:
+        lines.append(f'    {_identifier(name)} = ProxySignal({name!r})\n')
+    return ''.join(lines)
+
+
+def generate_source(schema):
+    # one class per interface, e.g. to be stored as a python module
+    return '\n\n'.join([
+        (
+            '# generated by xibus from introspection data\n'
+            'from xibus.typed import ProxyProperty\n'
+            'from xibus.typed import ProxySignal\n'
+            'from xibus.typed import TypedProxy\n'
+        ),
+        *(
+            _class_source(iface, definition)
+            for iface, definition in schema.interfaces.items()
+        ),
+    ])
+
+
+def _make_method(member, method):
+    sig = ''.join(typ for _, typ in method.args)
+    count = len(method.args)
+    returns = len(method.returns)
+
+    async def call(self, *args, timeout=None):
+        if len(args) != count:
+            raise TypeError(f'{member}() takes {count} arguments ({len(args)} given)')
+        result = await self._call(member, args, sig, timeout)
+        if returns == 1:
+            return result[0]
+        elif returns > 1:
+            return result
+
+    call.__name__ = call.__qualname__ = member
+    return call
+
+
+def _make_class(iface, definition):
+    attrs = {'iface': iface, '_signatures': _get_signatures(definition)}
+    for member, method in definition.methods.items():
+        attrs[_identifier(member)] = _make_method(member, method)
+    for name, p in definition.properties.items():
+        attrs[_identifier(name)] = ProxyProperty(name, p.type, p.access)
+    for name in definition.signals:
+        attrs[_identifier(name)] = ProxySignal(name)
+    return type(_class_name(iface), (TypedProxy,), attrs)
+
+
+def proxy_classes(schema):
+    # returns a dict that maps interface names to classes
+    if schema not in _classes:
+        _classes[schema] = {
+            iface: _make_class(iface, definition)
+            for iface, definition in schema.interfaces.items()
+        }
+    return _classes[schema]